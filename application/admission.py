@@ -0,0 +1,48 @@
+import math
+
+
+# Decides whether /invoke takes on more work, from load signals such as queue
+# depths and execution lag. Weak and strong ops have separate budgets, since
+# strong ops also occupy the consensus pipeline. A signal over its class
+# budget sheds that class with 429. A signal over an overload limit means
+# the node as a whole is behind and sheds everything with 503. A limit of 0
+# turns that check off.
+class AdmissionController:
+    def __init__(
+        self,
+        weak: dict,
+        strong: dict,
+        overload: dict,
+        retry_after: float = 1.0,
+        max_retry_after: float = 30.0,
+    ):
+        self.weak = weak
+        self.strong = strong
+        self.overload = overload
+        self.retry_after = retry_after
+        self.max_retry_after = max_retry_after
+        self.rejected = {"weak": 0, "strong": 0}
+
+    def check(self, strong_op: bool, signals: dict):
+        # returns None to admit, else (status, reason, retry after seconds)
+        rejection = self._over(self.overload, signals, 503)
+        if rejection is None:
+            budget = self.strong if strong_op else self.weak
+            rejection = self._over(budget, signals, 429)
+        if rejection is not None:
+            self.rejected["strong" if strong_op else "weak"] += 1
+        return rejection
+
+    def _over(self, limits: dict, signals: dict, status: int):
+        for name, limit in limits.items():
+            value = signals.get(name, 0)
+            if limit and value >= limit:
+                # the further over budget, the longer the client should wait
+                retry = min(self.max_retry_after, self.retry_after * value / limit)
+                return status, f"{name} {value} over limit {limit}", retry
+        return None
+
+
+def retry_after_header(seconds: float) -> str:
+    # Retry-After only takes whole seconds
+    return str(max(1, math.ceil(seconds)))
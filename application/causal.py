@@ -0,0 +1,222 @@
+# A set of request ids (node, event_no) stored as a version vector: the highest
+# event seen per node plus the events below it that are not in the set. Event
+# numbers are handed out contiguously per node, so the gaps stay small.
+class VersionVector:
+    def __init__(self, ids=()):
+        self.max = {}
+        self.gaps = {}
+        for req_id in ids:
+            self.add(req_id)
+
+    @classmethod
+    def from_json(cls, data: dict) -> "VersionVector":
+        vv = cls()
+        for node, top in data.get("vv", []):
+            vv.max[node] = top
+        for node, start, end in data.get("gaps", []):
+            vv.gaps.setdefault(node, set()).update(range(start, end + 1))
+        return vv
+
+    def to_json(self):
+        gaps = []
+        for node, events in self.gaps.items():
+            events = sorted(events)
+            start = prev = events[0]
+            for e in events[1:]:
+                if e != prev + 1:
+                    gaps.append([node, start, prev])
+                    start = e
+                prev = e
+            gaps.append([node, start, prev])
+        return {"vv": [[node, top] for node, top in self.max.items()], "gaps": gaps}
+
+    def copy(self) -> "VersionVector":
+        vv = VersionVector()
+        vv.max = dict(self.max)
+        vv.gaps = {node: set(events) for node, events in self.gaps.items()}
+        return vv
+
+    def add(self, req_id):
+        node, event = req_id
+        top = self.max.get(node, 0)
+        if event > top:
+            if event > top + 1:
+                self.gaps.setdefault(node, set()).update(range(top + 1, event))
+            self.max[node] = event
+        elif node in self.gaps:
+            self.gaps[node].discard(event)
+            if not self.gaps[node]:
+                del self.gaps[node]
+
+    def discard(self, req_id):
+        node, event = req_id
+        top = self.max.get(node, 0)
+        if event > top or event < 1:
+            return
+        gaps = self.gaps.setdefault(node, set())
+        gaps.add(event)
+        # keep max pointing at an event that is in the set
+        while top in gaps:
+            gaps.discard(top)
+            top -= 1
+        if top:
+            self.max[node] = top
+        else:
+            del self.max[node]
+        if not gaps:
+            del self.gaps[node]
+
+    def __contains__(self, req_id):
+        node, event = req_id
+        return 0 < event <= self.max.get(node, 0) and event not in self.gaps.get(
+            node, ()
+        )
+
+    def __len__(self):
+        return sum(self.max.values()) - sum(len(g) for g in self.gaps.values())
+
+    def __iter__(self):
+        for node, top in self.max.items():
+            gaps = self.gaps.get(node, ())
+            for event in range(1, top + 1):
+                if event not in gaps:
+                    yield (node, event)
+
+    def __sub__(self, ids) -> "VersionVector":
+        vv = self.copy()
+        for req_id in ids:
+            vv.discard(req_id)
+        return vv
+
+    def issubset(self, other: "VersionVector") -> bool:
+        for node, top in self.max.items():
+            if top > other.max.get(node, 0):
+                return False
+            own_gaps = self.gaps.get(node, ())
+            for event in other.gaps.get(node, ()):
+                if event <= top and event not in own_gaps:
+                    return False
+        return True
+
+    def difference(self, other: "VersionVector"):
+        # ids in self that are missing from other
+        for node, top in self.max.items():
+            own_gaps = self.gaps.get(node, ())
+            other_top = other.max.get(node, 0)
+            for event in other.gaps.get(node, ()):
+                if event <= top and event not in own_gaps:
+                    yield (node, event)
+            for event in range(other_top + 1, top + 1):
+                if event not in own_gaps:
+                    yield (node, event)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, VersionVector)
+            and self.max == other.max
+            and self.gaps == other.gaps
+        )
+
+    def __str__(self):
+        return f"VersionVector({self.max}, gaps={self.gaps})"
+
+    __repr__ = __str__
+
+
+# Duplicate-suppression set of request ids: per origin node, a watermark below
+# which every event has been seen plus the few events seen above it.
+class WatermarkSet:
+    def __init__(self):
+        self.watermark = {}
+        self.above = {}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "WatermarkSet":
+        ids = cls()
+        for node, mark in data.get("marks", []):
+            ids.watermark[node] = mark
+        for node, events in data.get("above", []):
+            ids.above[node] = set(events)
+        return ids
+
+    def to_json(self):
+        return {
+            "marks": [[node, mark] for node, mark in self.watermark.items()],
+            "above": [[node, sorted(events)] for node, events in self.above.items()],
+        }
+
+    def add(self, req_id):
+        node, event = req_id
+        mark = self.watermark.get(node, 0)
+        if event <= mark:
+            return
+        above = self.above.setdefault(node, set())
+        above.add(event)
+        while mark + 1 in above:
+            mark += 1
+            above.discard(mark)
+        self.watermark[node] = mark
+        if not above:
+            del self.above[node]
+
+    def __contains__(self, req_id):
+        node, event = req_id
+        return event <= self.watermark.get(node, 0) or event in self.above.get(
+            node, ()
+        )
+
+    def __len__(self):
+        return sum(self.watermark.values()) + sum(len(a) for a in self.above.values())
+
+    def difference(self, other: "WatermarkSet"):
+        # ids in self that are missing from other
+        for node, mark in self.watermark.items():
+            other_above = other.above.get(node, ())
+            for event in range(other.watermark.get(node, 0) + 1, mark + 1):
+                if event not in other_above:
+                    yield (node, event)
+        for node, events in self.above.items():
+            for event in sorted(events):
+                if (node, event) not in other:
+                    yield (node, event)
+
+    def __str__(self):
+        return f"WatermarkSet({self.watermark}, above={self.above})"
+
+    __repr__ = __str__
+
+
+# Ops parked until their causal context is delivered, indexed by the ids they
+# still miss so that a delivery only touches the ops waiting on it.
+class WaitingOps:
+    def __init__(self):
+        self.blocked_on = {}
+        self.outstanding = {}
+
+    def park(self, req, missing_ids):
+        count = 0
+        for req_id in missing_ids:
+            self.blocked_on.setdefault(req_id, []).append(req)
+            count += 1
+        self.outstanding[req.id] = [req, count]
+
+    def wake(self, req_id):
+        # returns the ops whose last missing dependency was req_id
+        ready = []
+        for req in self.blocked_on.pop(req_id, ()):
+            entry = self.outstanding[req.id]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.outstanding[req.id]
+                ready.append(req)
+        return ready
+
+    def get(self, req_id):
+        entry = self.outstanding.get(req_id)
+        return entry[0] if entry is not None else None
+
+    def __len__(self):
+        return len(self.outstanding)
+
+    def __iter__(self):
+        return (req for req, _ in self.outstanding.values())
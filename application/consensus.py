@@ -1,14 +1,17 @@
-import json
-import random
+import os
+import asyncio
 import logging
-import requests
 
-from server_helpers import get_node_address, NODE_ID, get_node_ids_excluding
-from redis_helpers import (
-    CONSENSUS_DECISION_QUEUE,
-    CONSENSUS_PROPOSAL_QUEUE,
-    get_redis_client,
+from server_helpers import (
+    get_http_client,
+    get_node_address,
+    post_message,
+    NODE_ID,
+    NO_NODES,
+    get_node_ids_excluding,
 )
+from queues import get_queues
+from redis_helpers import CONSENSUS_DECISION_QUEUE, CONSENSUS_PROPOSAL_QUEUE
 
 
 logging.basicConfig(
@@ -19,47 +22,115 @@ logging.basicConfig(
 logger = logging.getLogger()
 
 
-def send_proposal(node_index, json_data, path="/propose-cab"):
+CONSENSUS_TIMEOUT = float(os.getenv("CONSENSUS_TIMEOUT", "2"))
+CONSENSUS_RETRIES = int(os.getenv("CONSENSUS_RETRIES", "5"))
+CONSENSUS_BATCH_SIZE = int(os.getenv("CONSENSUS_BATCH_SIZE", "100"))
+# acks needed from peers so that, with this node, a majority has the message
+QUORUM = NO_NODES // 2
+
+# sends to lagging peers that keep retrying after the quorum was reached
+BACKGROUND_SENDS = set()
+# peer -> (k, messages) of the last proposal that peer acknowledged
+ACKED_PROPOSALS = {}
+
+
+async def send_proposal(client, node_index, json_data, path="/propose-cab"):
     logger.info("Sending consensus to node %s at path %s", node_index, path)
-    retries = 2
     url = f"{get_node_address(node_index)}{path}"
-    for attempt in range(retries):
+    for attempt in range(CONSENSUS_RETRIES):
         try:
             logger.info(
                 "Attempt %s to send consensus to %s data %s", attempt + 1, url, json_data
             )
-            resp = requests.post(url, json=json_data)
+            resp = await post_message(
+                client, node_index, path, json_data, timeout=CONSENSUS_TIMEOUT
+            )
             resp.raise_for_status()
             return resp.json()
         except Exception as e:
             logger.info("Attempt %s failed: %s", attempt + 1, e)
-    logger.info("Failed to send to %s after %s attempts", url, retries)
+            await asyncio.sleep(min(0.05 * 2**attempt, 1))
+    logger.info("Failed to send to %s after %s attempts", url, CONSENSUS_RETRIES)
 
 
-def main():
-    logger.info("Consensus application started.")
-    r = get_redis_client()
+async def propose(client, node_index, item):
+    # ships only the difference to the last proposal the peer acknowledged and
+    # falls back to the full set if the peer no longer has that proposal
+    unordered = set(tuple(m) for m in item["unordered"])
+    data = item
+    acked = ACKED_PROPOSALS.get(node_index)
+    if acked is not None and acked[0] < item["k"]:
+        data = {
+            **item,
+            "unordered": [list(m) for m in unordered - acked[1]],
+            "removed": [list(m) for m in acked[1] - unordered],
+            "base": acked[0],
+        }
+    resp = await send_proposal(client, node_index, data, path="/propose-cab")
+    if data is not item and resp is not None and resp.get("msg") == "Missing base":
+        resp = await send_proposal(client, node_index, item, path="/propose-cab")
+    if resp is not None and resp.get("msg") != "Missing base":
+        acked = ACKED_PROPOSALS.get(node_index)
+        if acked is None or acked[0] < item["k"]:
+            ACKED_PROPOSALS[node_index] = (item["k"], unordered)
+    return resp
+
+
+async def broadcast(client, item, path):
+    # sends to every peer at once and returns as soon as a quorum answered;
+    # the remaining sends carry on in the background
+    if path == "/propose-cab":
+        sends = [
+            asyncio.create_task(propose(client, i, item))
+            for i in get_node_ids_excluding(NODE_ID)
+        ]
+    else:
+        sends = [
+            asyncio.create_task(send_proposal(client, i, item, path=path))
+            for i in get_node_ids_excluding(NODE_ID)
+        ]
+    acks = 0
+    pending = set(sends)
+    while pending and acks < QUORUM:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for send in done:
+            resp = send.result()
+            logger.info("Response %s", resp)
+            if resp is not None:
+                acks += 1
+    for send in pending:
+        BACKGROUND_SENDS.add(send)
+        send.add_done_callback(BACKGROUND_SENDS.discard)
+    logger.info("Dequeued %s with %s acks: %s", path, acks, item)
+
+
+async def run(queues, client):
+    logger.info("Consensus started.")
     while True:
-        item = r.rpop(CONSENSUS_PROPOSAL_QUEUE)
-        if item:
-            item = json.loads(item)
-            nodes = get_node_ids_excluding(NODE_ID)
-            random.shuffle(nodes)
-            for i in nodes:
-                resp = send_proposal(i, item, path="/propose-cab")
-                logger.info("Response %s", resp)
-            logger.info("Dequeued: %s", item)
-
-        item = r.rpop(CONSENSUS_DECISION_QUEUE)
-        if item:
-            item = json.loads(item)
-            nodes = get_node_ids_excluding(NODE_ID)
-            random.shuffle(nodes)
-            for i in nodes:
-                resp = send_proposal(i, item, path="/decide-cab")
-                logger.info("Response %s", resp)
-            logger.info("Dequeued: %s", item)
+        batch = await queues.pop_batch(
+            [CONSENSUS_PROPOSAL_QUEUE, CONSENSUS_DECISION_QUEUE],
+            CONSENSUS_BATCH_SIZE,
+        )
+        if not batch:
+            continue
+        await asyncio.gather(
+            *[
+                broadcast(client, item, "/propose-cab")
+                for item in batch[CONSENSUS_PROPOSAL_QUEUE]
+            ],
+            *[
+                broadcast(client, item, "/decide-cab")
+                for item in batch[CONSENSUS_DECISION_QUEUE]
+            ],
+        )
+
+
+async def main():
+    logger.info("Consensus application started.")
+    queues = get_queues()
+    async with get_http_client() as client:
+        await run(queues, client)
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+import math
+import random
+
+
+# Picks the peers a gossip batch is pushed to. The fanout starts at about
+# log2(N) so a push reaches every node in O(log N) rounds, then follows the
+# share of pushed items peers report as duplicates: many duplicates mean the
+# cluster is already saturated and the fanout drops, few mean it can grow.
+# Peers are sampled with weight 1/latency so fast links carry most pushes
+# while slow ones are still picked now and then.
+class Dissemination:
+    def __init__(
+        self,
+        no_nodes: int,
+        min_fanout: int = 1,
+        max_fanout: int | None = None,
+        duplicate_target: float = 0.5,
+        window: int = 100,
+        alpha: float = 0.2,
+    ):
+        self.no_nodes = no_nodes
+        if max_fanout is None:
+            max_fanout = max(1, math.ceil(math.log2(max(no_nodes, 2))) + 1)
+        self.min_fanout = min_fanout
+        self.max_fanout = max(min_fanout, max_fanout)
+        self.fanout = min(
+            self.max_fanout, max(min_fanout, math.ceil(math.log2(max(no_nodes, 2))))
+        )
+        self.duplicate_target = duplicate_target
+        self.window = window
+        self.alpha = alpha
+        # peer -> smoothed round-trip time of a push, in seconds
+        self.latency = {}
+        self.pushed = 0
+        self.duplicates = 0
+
+    def choose(self, exclude) -> list[int]:
+        peers = [i for i in range(self.no_nodes) if i != exclude]
+        k = min(self.fanout, len(peers))
+        if k == len(peers):
+            return peers
+        # peers without a sample yet get the best known latency so they are tried
+        known = [self.latency[i] for i in peers if i in self.latency]
+        default = min(known) if known else 1.0
+        # weighted sampling without replacement (Efraimidis-Spirakis)
+        keyed = [
+            (random.random() ** (self.latency.get(i, default) or 1e-6), i)
+            for i in peers
+        ]
+        keyed.sort(reverse=True)
+        return [i for _, i in keyed[:k]]
+
+    def record_send(self, peer: int, seconds: float, ok: bool):
+        if not ok:
+            # a failed push counts as a slow one until the peer answers again
+            seconds = max(seconds, 2 * self.latency.get(peer, seconds))
+        if peer in self.latency:
+            seconds = (1 - self.alpha) * self.latency[peer] + self.alpha * seconds
+        self.latency[peer] = seconds
+
+    def record_response(self, pushed: int, duplicates: int):
+        self.pushed += pushed
+        self.duplicates += duplicates
+        if self.pushed < self.window:
+            return
+        ratio = self.duplicates / self.pushed
+        self.pushed = self.duplicates = 0
+        if ratio > self.duplicate_target and self.fanout > self.min_fanout:
+            self.fanout -= 1
+        elif ratio < self.duplicate_target / 2 and self.fanout < self.max_fanout:
+            self.fanout += 1
+
+    def __str__(self):
+        return f"Dissemination(fanout={self.fanout}, latency={self.latency})"
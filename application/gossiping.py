@@ -1,10 +1,18 @@
-import json
+import os
+import time
+import asyncio
 import logging
 
-import requests
-
-from redis_helpers import get_redis_client, BUFFER_QUEUE, CAB_BUFFER_QUEUE
-from server_helpers import get_node_address, NODE_ID, random_sample_excluding
+from dissemination import Dissemination
+from queues import get_queues
+from redis_helpers import BUFFER_QUEUE, CAB_BUFFER_QUEUE
+from server_helpers import (
+    get_http_client,
+    get_node_address,
+    post_message,
+    NODE_ID,
+    NO_NODES,
+)
 
 
 logging.basicConfig(
@@ -15,12 +23,25 @@ logging.basicConfig(
 logger = logging.getLogger()
 
 
-GOSSIP_FANOUT = 1
+# a fixed GOSSIP_FANOUT turns off the adaptive fanout
+GOSSIP_FANOUT = os.getenv("GOSSIP_FANOUT")
+GOSSIP_MIN_FANOUT = int(os.getenv("GOSSIP_MIN_FANOUT", GOSSIP_FANOUT or "1"))
+GOSSIP_MAX_FANOUT = os.getenv("GOSSIP_MAX_FANOUT", GOSSIP_FANOUT)
+GOSSIP_DUPLICATE_TARGET = float(os.getenv("GOSSIP_DUPLICATE_TARGET", "0.5"))
+GOSSIP_BATCH_SIZE = int(os.getenv("GOSSIP_BATCH_SIZE", "100"))
+GOSSIP_LINGER_MS = float(os.getenv("GOSSIP_LINGER_MS", "2"))
+
+DISSEMINATION = Dissemination(
+    NO_NODES,
+    min_fanout=GOSSIP_MIN_FANOUT,
+    max_fanout=int(GOSSIP_MAX_FANOUT) if GOSSIP_MAX_FANOUT else None,
+    duplicate_target=GOSSIP_DUPLICATE_TARGET,
+)
 
-logger.info("GOSSIPING_FANOUT: %s", GOSSIP_FANOUT)
+logger.info("GOSSIPING_FANOUT: %s", DISSEMINATION.fanout)
 
 
-def send_gossip(node_index, json_data, path="/gossip"):
+async def send_gossip(client, node_index, json_data, path="/gossip"):
     logger.info("Sending gossip to node %s", node_index)
     retries = 2
     url = f"{get_node_address(node_index)}{path}"
@@ -29,7 +50,7 @@ def send_gossip(node_index, json_data, path="/gossip"):
             logger.info(
                 "Attempt %s to send gossip to %s data %s", attempt + 1, url, json_data
             )
-            resp = requests.post(url, json=json_data)
+            resp = await post_message(client, node_index, path, json_data)
             resp.raise_for_status()
             return resp.json()
         except Exception as e:
@@ -37,28 +58,51 @@ def send_gossip(node_index, json_data, path="/gossip"):
     logger.info("Failed to send to %s after %s attempts", url, retries)
 
 
-def main():
-    logging.info("Gossiping application started.")
-    r = get_redis_client()
+def route(items, exclude):
+    per_peer = {}
+    for item in items:
+        for i in DISSEMINATION.choose(exclude):
+            per_peer.setdefault(i, []).append(item)
+    return per_peer
+
+
+async def gossip_batch(client, node_index, items, path, field):
+    start = time.monotonic()
+    resp = await send_gossip(client, node_index, {field: items}, path=path)
+    DISSEMINATION.record_send(node_index, time.monotonic() - start, resp is not None)
+    if resp is not None and "duplicates" in resp:
+        DISSEMINATION.record_response(len(items), resp["duplicates"])
+    logger.info("Response %s, %s", resp, DISSEMINATION)
+    logger.info("Dequeued %s items for %s", len(items), path)
+
+
+async def run(queues, client):
+    logger.info("Gossiping started.")
     while True:
-        item = r.rpop(BUFFER_QUEUE)
-        if item:
-            k = random_sample_excluding(GOSSIP_FANOUT, NODE_ID)
-            item = json.loads(item)
-            for indx in k:
-                resp = send_gossip(indx, item, path="/gossip")
-                logger.info("Response %s", resp)
-            logger.info("Dequeued: %s", item)
-
-        item = r.rpop(CAB_BUFFER_QUEUE)
-        if item:
-            k = random_sample_excluding(GOSSIP_FANOUT, None)
-            item = json.loads(item)
-            for indx in k:
-                resp = send_gossip(indx, item, path="/gossip-cab")
-                logger.info("Response %s", resp)
-            logger.info("Dequeued CAB: %s", item)
+        batch = await queues.pop_batch(
+            [BUFFER_QUEUE, CAB_BUFFER_QUEUE],
+            GOSSIP_BATCH_SIZE,
+            linger=GOSSIP_LINGER_MS / 1000,
+            raw=True,
+        )
+        if not batch:
+            continue
+        sends = [
+            gossip_batch(client, i, items, "/gossip-batch", "requests")
+            for i, items in route(batch[BUFFER_QUEUE], NODE_ID).items()
+        ] + [
+            gossip_batch(client, i, items, "/gossip-cab-batch", "messages")
+            for i, items in route(batch[CAB_BUFFER_QUEUE], NODE_ID).items()
+        ]
+        await asyncio.gather(*sends)
+
+
+async def main():
+    logging.info("Gossiping application started.")
+    queues = get_queues()
+    async with get_http_client() as client:
+        await run(queues, client)
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+import os
+import time
+import logging
+
+logger = logging.getLogger("myapp")
+
+# bits of a timestamp kept for the logical counter
+LOGICAL_BITS = 12
+# how far ahead of the local clock a peer's timestamp may move this clock
+HLC_MAX_DRIFT_MS = float(os.getenv("HLC_MAX_DRIFT_MS", "60000"))
+
+
+def physical_now() -> int:
+    return time.time_ns() // 1000
+
+
+# Hybrid logical clock. Timestamps are the physical time in microseconds
+# shifted left by LOGICAL_BITS plus a logical counter, so they compare as
+# plain ints, stay close to wall-clock time, and never go backwards. They also
+# move past every timestamp received from a peer, so an op issued after
+# seeing a remote op is ordered after it even when the local clock lags.
+class HybridLogicalClock:
+    def __init__(self, clock=physical_now, max_drift_ms: float = HLC_MAX_DRIFT_MS):
+        self.clock = clock
+        self.max_drift = int(max_drift_ms * 1000) << LOGICAL_BITS
+        self.last = 0
+
+    def now(self) -> int:
+        # physical time only advances the clock, the counter breaks ties
+        self.last = max(self.last + 1, self.clock() << LOGICAL_BITS)
+        return self.last
+
+    def update(self, ts: int) -> int:
+        # a peer with a clock far in the future, or a corrupt timestamp, would
+        # otherwise drag every later local timestamp along with it for good
+        now = self.clock() << LOGICAL_BITS
+        if ts > now + self.max_drift:
+            logger.info(
+                "Clamping a timestamp %s ms ahead of the local clock",
+                ((ts - now) >> LOGICAL_BITS) // 1000,
+            )
+            ts = now + self.max_drift
+        if ts > self.last:
+            self.last = ts
+        return self.last
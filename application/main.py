@@ -1,116 +1,262 @@
 import os
 import json
+import random
 import asyncio
 import logging
 
-from fastapi import FastAPI
+import httpx
+
+from fastapi import Depends, FastAPI, HTTPException, Request as HTTPRequest, Response
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
+from pydantic import ValidationError
+
+import wire
 
+from admission import AdmissionController, retry_after_header
 from state import State
+from storage import get_storage
 from req import Request, Message
+from operation import Operation
+from causal import VersionVector, WaitingOps, WatermarkSet
+from hlc import HybridLogicalClock
+from ordered_log import OrderedLog
+from planner import ConflictAwarePlanner, ExecutionPlanner
+from wal import WALError, WriteAheadLog
+from sharding import SHARD_ID
 from custom_logger import setup_logging
 from models import (
     DecideCABModel,
+    GossipCABBatchModel,
     GossipCABModel,
+    GossipBatchModel,
+    InvokeBatchModel,
     InvokeRequestModel,
     GossipModel,
     ProposeCABModel,
+    SyncRequestModel,
 )
+from queues import get_queues
+from server_helpers import get_http_client, get_node_address, get_node_ids_excluding
 from redis_helpers import (
+    BUFFER_QUEUE,
     CAB_BUFFER_QUEUE,
     CONSENSUS_DECISION_QUEUE,
     CONSENSUS_PROPOSAL_QUEUE,
-    get_redis_client,
-    BUFFER_QUEUE,
 )
 
 setup_logging()
 logger = logging.getLogger("myapp")
 
-r = get_redis_client()
 
 NODE_URLS = os.getenv("NODE_URLS", "0").split(",")
 NO_NODES = len(NODE_URLS)
 NODE_ID = int(os.getenv("NODE_ID", "0"))
+CONFLICT_AWARE_EXECUTION = os.getenv("CONFLICT_AWARE_EXECUTION", "0") == "1"
+SCHEDULER_BATCH = int(os.getenv("SCHEDULER_BATCH", "1000"))
+CONSENSUS_WINDOW = int(os.getenv("CONSENSUS_WINDOW", "1"))
+# run the gossip and consensus senders as tasks of this process
+IN_PROCESS = os.getenv("IN_PROCESS", "0") == "1"
+# directory for the write-ahead log and snapshots; unset keeps state in memory
+WAL_DIR = os.getenv("WAL_DIR")
+WAL_GROUP_COMMIT_MS = float(os.getenv("WAL_GROUP_COMMIT_MS", "1"))
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "60"))
+# seconds between pulls of missed requests from a random peer, 0 disables
+ANTI_ENTROPY_INTERVAL = float(os.getenv("ANTI_ENTROPY_INTERVAL", "5"))
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "1000"))
+# seconds /invoke waits for the result when the client asks for it
+INVOKE_TIMEOUT = float(os.getenv("INVOKE_TIMEOUT", "5"))
+# admission limits per load signal, 0 disables a limit; weak and strong ops
+# are shed with 429 past their own budget, everything with 503 past overload
+ADMIT_WEAK = {
+    "tentative": int(os.getenv("ADMIT_WEAK_TENTATIVE", "100000")),
+    "execution_lag": int(os.getenv("ADMIT_WEAK_EXECUTION_LAG", "50000")),
+    "gossip_backlog": int(os.getenv("ADMIT_WEAK_GOSSIP_BACKLOG", "50000")),
+}
+ADMIT_STRONG = {
+    "tentative": int(os.getenv("ADMIT_STRONG_TENTATIVE", "100000")),
+    "unordered": int(os.getenv("ADMIT_STRONG_UNORDERED", "10000")),
+    "consensus_backlog": int(os.getenv("ADMIT_STRONG_CONSENSUS_BACKLOG", "1000")),
+    "waiting": int(os.getenv("ADMIT_STRONG_WAITING", "10000")),
+}
+ADMIT_OVERLOAD = {
+    "execution_lag": int(os.getenv("ADMIT_OVERLOAD_EXECUTION_LAG", "200000")),
+    "tentative": int(os.getenv("ADMIT_OVERLOAD_TENTATIVE", "400000")),
+}
+RETRY_AFTER_MS = float(os.getenv("RETRY_AFTER_MS", "1000"))
+# milliseconds between samples of the queue backlog
+ADMISSION_SAMPLE_MS = float(os.getenv("ADMISSION_SAMPLE_MS", "50"))
 
 logger.info("NO_NODES: %s", NO_NODES)
 logger.info("NODE_ID: %s", NODE_ID)
-
-STATE = State()
+logger.info("SHARD_ID: %s", SHARD_ID)
+logger.info("CONFLICT_AWARE_EXECUTION: %s", CONFLICT_AWARE_EXECUTION)
+logger.info("CONSENSUS_WINDOW: %s", CONSENSUS_WINDOW)
+logger.info("IN_PROCESS: %s", IN_PROCESS)
+logger.info("WAL_DIR: %s", WAL_DIR)
+logger.info("ANTI_ENTROPY_INTERVAL: %s", ANTI_ENTROPY_INTERVAL)
+logger.info("ADMIT_WEAK: %s", ADMIT_WEAK)
+logger.info("ADMIT_STRONG: %s", ADMIT_STRONG)
+logger.info("ADMIT_OVERLOAD: %s", ADMIT_OVERLOAD)
+
+r = get_queues(IN_PROCESS)
+STATE = State(get_storage())
+WAL = WriteAheadLog(WAL_DIR, WAL_GROUP_COMMIT_MS / 1000) if WAL_DIR else None
 
 CURR_EVENT_NO = 0
-CAUSAL_CTX = set()
-COMMITTED = []
-TENTATIVE = []
-EXECUTED = []
-TO_BE_EXECUTED = []
-TO_BE_ROLLEDBACK = []
+CLOCK = HybridLogicalClock()
+CAUSAL_CTX = VersionVector()
+LOG = OrderedLog()
+if CONFLICT_AWARE_EXECUTION:
+    PLANNER = ConflictAwarePlanner(LOG, STATE)
+else:
+    PLANNER = ExecutionPlanner(LOG)
+# request id -> future /invoke waits on for (result, committed)
 REQUEST_AWAITING_RESP = {}
-MISSING_CONTEXT_OPS = set()
+# strong op id -> result of its latest tentative execution, until it commits
+TENTATIVE_RESULTS = {}
+MISSING_CONTEXT_OPS = WaitingOps()
+ADMISSION = AdmissionController(
+    ADMIT_WEAK, ADMIT_STRONG, ADMIT_OVERLOAD, retry_after=RETRY_AFTER_MS / 1000
+)
+# last sampled queue lengths, reading them on every /invoke would cost a
+# round trip to Redis
+QUEUE_BACKLOG = {}
 
 BUFFER = set()
-DELIVERED = set()
-DELIVERED_CAB = set()
+DELIVERED = WatermarkSet()
+DELIVERED_CAB = WatermarkSet()
 
-RECEIVED = set()
+RECEIVED = WatermarkSet()
 ORDERED_MESSAGES = list()
 UNORDERED_MESSAGES = set()
 
 CONSENSUS_K = 0
 DELIVERED_CONSENSUS_PROPOSALS = {}
 DELIVERED_CONSENSUS_DECISIONS = {}
-DECIDING_CONSENSUS = False
-APPLYING_CONSENSUS = False
+APPLIED_CONSENSUS_K = 0
+DECIDED_CONSENSUS_K = set()
+# k -> messages this node proposed in instance k, until k is applied
+PROPOSED_MESSAGES = {}
+# server -> (k, messages) of its latest proposal, kept after k is collected
+# since the server's next proposal is usually a delta against it
+LATEST_PROPOSALS = {}
+# highest k each peer reported as applied, and the k up to which every
+# node has applied and the per-k bookkeeping was dropped
+PEER_APPLIED_CONSENSUS_K = {}
+CONSENSUS_GC_K = 0
+
+# set whenever the input of the matching background task changes
+ROLLBACK_READY = asyncio.Event()
+EXECUTE_READY = asyncio.Event()
+UNORDERED_READY = asyncio.Event()
+PROPOSALS_READY = asyncio.Event()
+DECISIONS_READY = asyncio.Event()
+ORDERED_READY = asyncio.Event()
+
+
+def notify(*events: asyncio.Event):
+    for event in events:
+        event.set()
+
+
+async def wait_for(event: asyncio.Event):
+    await event.wait()
+    event.clear()
+
+
+def log_record(record: dict):
+    if WAL is not None:
+        WAL.append(record)
+
+
+async def make_durable():
+    # acknowledge only what a restart would recover
+    if WAL is not None:
+        await WAL.sync()
+
+
+def check_wal():
+    # after a failed write it is unknown what a restart recovers, so from
+    # then on nothing is changed, served or sent, including the ops whose
+    # sync failed
+    if WAL is not None and WAL.failed is not None:
+        raise WALError("write-ahead log failed")
 
 
 def predicate_check_dep(req_id):
-    global COMMITTED, TENTATIVE, CAUSAL_CTX
-    r = [req for req in COMMITTED + TENTATIVE if req.id == req_id]
-    logger.info(
-        "Predicate check dep called for request %s, COMMITTED: %s, TENTATIVE: %s",
-        req_id,
-        COMMITTED,
-        TENTATIVE,
-    )
-    if not r:
+    global LOG, CAUSAL_CTX
+    r = LOG.get(req_id)
+    logger.info("Predicate check dep called for request %s, LOG: %s", req_id, LOG)
+    if r is None:
         logger.info("Request %s not found in COMMITTED or TENTATIVE", req_id)
         return False
     logger.info(
         "Checking predicate for request %s with causal context %s, causal context %s",
         req_id,
-        r[0].causal_ctx,
+        r.causal_ctx,
         CAUSAL_CTX,
     )
-    return r[0].causal_ctx.issubset(CAUSAL_CTX)
+    return r.causal_ctx.issubset(CAUSAL_CTX)
 
 
-def CAB_cast(m, q):
+def CAB_cast(m, q) -> Message:
+    global DELIVERED_CAB
     logger.info("CAB_cast called for message %s", m)
     msg = Message(m, q)
+    # delivered here rather than gossiped back to this node, so gossip only
+    # carries it to peers; send it with CAB_send once it is durable
+    DELIVERED_CAB.add(msg.m)
+    log_record({"t": "msg", "msg": msg.to_json()})
+    RB_deliver_msg(msg)
+    return msg
+
+
+def CAB_send(msg: Message):
     add_to_cab_buffer(msg.to_json())
 
 
 def RB_cast(r):
     logger.info("RB_cast called for request %s", r.id)
     add_to_buffer(r.to_json())
+
+
+def mark_delivered(r: Request):
     DELIVERED.add(r.id)
+    if not r.strong_op:
+        # weak ops never get a CAB message; counting their ids as delivered
+        # ones lets the CAB watermarks move past them
+        DELIVERED_CAB.add(r.id)
+        RECEIVED.add(r.id)
 
 
-def RB_deliver(r):
+def add_to_causal_ctx(req_id):
     global CAUSAL_CTX, MISSING_CONTEXT_OPS
-    logger.info("RB_deliver called for request %s", r.id)
-    if r.id[0] == NODE_ID:
-        return
-    if not r.strong_op or r.causal_ctx.issubset(CAUSAL_CTX):
-        CAUSAL_CTX.add(r.id)
-        ready_to_schedule_ops = {r}
-        for x in {x for x in MISSING_CONTEXT_OPS if x.causal_ctx.issubset(CAUSAL_CTX)}:
-            CAUSAL_CTX.add(x.id)
-            ready_to_schedule_ops.add(x)
-            MISSING_CONTEXT_OPS.remove(x)
+    CAUSAL_CTX.add(req_id)
+    return MISSING_CONTEXT_OPS.wake(req_id)
+
+
+def RB_deliver(reqs):
+    global CAUSAL_CTX, MISSING_CONTEXT_OPS
+    deliverable = []
+    for r in reqs:
+        logger.info("RB_deliver called for request %s", r.id)
+        if r.id[0] == NODE_ID:
+            continue
+        missing = []
+        if r.strong_op:
+            missing = list(r.causal_ctx.difference(CAUSAL_CTX))
+        if missing:
+            MISSING_CONTEXT_OPS.park(r, missing)
+        else:
+            deliverable.append(r)
+    ready_to_schedule_ops = set()
+    while deliverable:
+        x = deliverable.pop()
+        ready_to_schedule_ops.add(x)
+        deliverable.extend(add_to_causal_ctx(x.id))
+    if ready_to_schedule_ops:
         insert_into_tentative(ready_to_schedule_ops)
-    else:
-        MISSING_CONTEXT_OPS.add(r)
 
 
 def RB_deliver_msg(msg):
@@ -119,6 +265,8 @@ def RB_deliver_msg(msg):
     RECEIVED.add(msg.m)
     if msg.m not in ORDERED_MESSAGES:
         UNORDERED_MESSAGES.add(msg.m)
+        notify(UNORDERED_READY)
+    notify(ORDERED_READY)
 
 
 def predicate_test(req_id: int):
@@ -131,172 +279,243 @@ def predicate_test(req_id: int):
 
 def add_to_buffer(msg: json):
     logger.info("Adding message to buffer: %s", msg)
-    r.lpush(BUFFER_QUEUE, json.dumps(msg))
+    r.lpush(BUFFER_QUEUE, msg)
 
 
 def add_to_cab_buffer(msg: json):
     logger.info("Adding message to buffer: %s", msg)
-    r.lpush(CAB_BUFFER_QUEUE, json.dumps(msg))
+    r.lpush(CAB_BUFFER_QUEUE, msg)
 
 
 def add_to_consensus_proposal_buffer(msg: json):
     logger.info("Adding message to buffer: %s", msg)
-    r.lpush(CONSENSUS_PROPOSAL_QUEUE, json.dumps(msg))
+    r.lpush(CONSENSUS_PROPOSAL_QUEUE, msg)
 
 
 def add_to_consensus_decision_buffer(msg: json):
     logger.info("Adding message to buffer: %s", msg)
-    r.lpush(CONSENSUS_DECISION_QUEUE, json.dumps(msg))
+    r.lpush(CONSENSUS_DECISION_QUEUE, msg)
 
 
 async def rollback():
-    global STATE, TO_BE_ROLLEDBACK
+    global STATE, PLANNER
     logger.info("Rollback task started")
     while True:
-        if TO_BE_ROLLEDBACK:
-            r = TO_BE_ROLLEDBACK.pop(0)
+        await wait_for(ROLLBACK_READY)
+        done = 0
+        while True:
+            r = PLANNER.next_rollback()
+            if r is None:
+                break
             logger.info("Rolling back operation %s", r.id)
-            STATE.rollback(r)
-        await asyncio.sleep(0.001)  # Simulate rollback delay
+            try:
+                STATE.rollback(r)
+            except Exception:
+                logger.exception("Rolling back operation %s failed", r.id)
+            done += 1
+            if done % SCHEDULER_BATCH == 0:
+                await asyncio.sleep(0)
+        notify(EXECUTE_READY)
 
 
 async def execute():
-    global STATE, EXECUTED, TO_BE_EXECUTED, TO_BE_ROLLEDBACK
+    global STATE, PLANNER, LOG
     logger.info("Execute task started")
     while True:
-        if not TO_BE_ROLLEDBACK and TO_BE_EXECUTED:
-            r = TO_BE_EXECUTED.pop(0)
+        await wait_for(EXECUTE_READY)
+        await prefetch_upcoming()
+        done = 0
+        while True:
+            r = PLANNER.next_execution()
+            if r is None:
+                break
             logger.info("Executing operation %s", r.id)
-            STATE.execute(r)
-            EXECUTED.append(r)
-        await asyncio.sleep(0.001)  # Simulate execution delay
+            try:
+                result = STATE.execute(r)
+            except Exception:
+                # one bad op must not stop execution of everything after it
+                logger.exception("Executing operation %s failed", r.id)
+                result = None
+            PLANNER.mark_executed(r)
+            committed = LOG.is_committed(r.id)
+            if committed:
+                STATE.commit(r)
+            if r.id in REQUEST_AWAITING_RESP:
+                note_result(r, result, committed)
+            done += 1
+            if done % SCHEDULER_BATCH == 0:
+                await asyncio.sleep(0)
+                await prefetch_upcoming()
+
+
+async def prefetch_upcoming():
+    # loads the values the next batch reads, so the storage engine does not
+    # block the event loop on them; the plan may change meanwhile, which only
+    # costs a synchronous read
+    await STATE.prefetch(r.op for r in PLANNER.upcoming(SCHEDULER_BATCH))
+
+
+def note_result(r: Request, result, committed: bool):
+    # weak ops answer with their first execution, strong ops only once the
+    # execution is in commit order
+    if r.strong_op and not committed:
+        TENTATIVE_RESULTS[r.id] = result
+        return
+    future = REQUEST_AWAITING_RESP[r.id]
+    if not future.done():
+        future.set_result((result, committed))
+
+
+def in_flight_messages():
+    in_flight = set()
+    for msgs in PROPOSED_MESSAGES.values():
+        in_flight |= msgs
+    return in_flight
 
 
 async def process_unordered_messages():
     logger.info("Processing unordered messages task started.")
-    global UNORDERED_MESSAGES, CONSENSUS_K, DELIVERED_CONSENSUS_PROPOSALS, DECIDING_CONSENSUS
+    global UNORDERED_MESSAGES, CONSENSUS_K, DELIVERED_CONSENSUS_PROPOSALS, PROPOSED_MESSAGES
     while True:
-        if UNORDERED_MESSAGES and not DECIDING_CONSENSUS:
+        await wait_for(UNORDERED_READY)
+        proposals = []
+        while CONSENSUS_K - APPLIED_CONSENSUS_K < CONSENSUS_WINDOW:
+            # messages already proposed in an open instance wait for its outcome
+            unordered_messages = UNORDERED_MESSAGES - in_flight_messages()
+            if not unordered_messages:
+                break
+            CONSENSUS_K = CONSENSUS_K + 1
             logger.info(
                 "Processing unordered messages for consensus k: %s", CONSENSUS_K
             )
-            unordered_messages = UNORDERED_MESSAGES.copy()
-            CONSENSUS_K = CONSENSUS_K + 1
+            PROPOSED_MESSAGES[CONSENSUS_K] = unordered_messages
             # add self to consesus list
-            DELIVERED_CONSENSUS_PROPOSALS[CONSENSUS_K] = [
+            DELIVERED_CONSENSUS_PROPOSALS.setdefault(CONSENSUS_K, {})[NODE_ID] = set(
+                tuple(msg) for msg in unordered_messages
+            )
+            log_record(
                 {
+                    "t": "propose",
                     "server": NODE_ID,
-                    "unordered": set(tuple(msg) for msg in unordered_messages),
                     "k": CONSENSUS_K,
+                    "unordered": [list(msg) for msg in unordered_messages],
                 }
-            ]
-            add_to_consensus_proposal_buffer(
+            )
+            proposals.append(
                 {
                     "server": NODE_ID,
                     "unordered": [list(msg) for msg in unordered_messages],
                     "k": CONSENSUS_K,
                 }
             )
-            DECIDING_CONSENSUS = True
-        await asyncio.sleep(0.001)  # Simulate processing delay
+            notify(PROPOSALS_READY)
+        if proposals:
+            # a restarted node must not propose something else for the same k
+            await make_durable()
+            for proposal in proposals:
+                add_to_consensus_proposal_buffer(
+                    {**proposal, "applied": APPLIED_CONSENSUS_K}
+                )
 
 
 async def decide_consensus():
     logger.info("Deciding consensus task started.")
-    global DECIDING_CONSENSUS, DELIVERED_CONSENSUS_PROPOSALS, APPLYING_CONSENSUS
+    global DELIVERED_CONSENSUS_PROPOSALS, DELIVERED_CONSENSUS_DECISIONS, DECIDED_CONSENSUS_K
     while True:
-        if (
-            DECIDING_CONSENSUS
-            and not APPLYING_CONSENSUS
-            and len(DELIVERED_CONSENSUS_PROPOSALS[CONSENSUS_K]) >= (NO_NODES / 2)
-        ):
-            logger.info("Deciding consensus for k: %s", CONSENSUS_K)
-            proposals = [
-                p["unordered"] for p in DELIVERED_CONSENSUS_PROPOSALS[CONSENSUS_K]
-            ]
+        await wait_for(PROPOSALS_READY)
+        decisions = {}
+        for k in range(APPLIED_CONSENSUS_K + 1, CONSENSUS_K + 1):
+            if k in DECIDED_CONSENSUS_K or len(
+                DELIVERED_CONSENSUS_PROPOSALS.get(k, {})
+            ) < (NO_NODES / 2):
+                continue
+            logger.info("Deciding consensus for k: %s", k)
+            proposals = list(DELIVERED_CONSENSUS_PROPOSALS[k].values())
             decided = set.intersection(*proposals)
-            # check for predicate
+            # check for predicate; even if no messages satisfy carry the
+            # consesus forward with empty decision
             decided = [d for d in decided if predicate_test(d)]
-            if decided:
-                DELIVERED_CONSENSUS_DECISIONS[CONSENSUS_K] = [
-                    {
-                        "server": NODE_ID,
-                        "decided": set(tuple(msg) for msg in decided),
-                        "k": CONSENSUS_K,
-                    }
-                ]
-                # send the decision
-                add_to_consensus_decision_buffer(
-                    {
-                        "server": NODE_ID,
-                        "decided": [list(d) for d in decided],
-                        "k": CONSENSUS_K,
-                    }
-                )
-            else:
-                # even if no messages satisfy carry the consesus forward with empty decision
-                DELIVERED_CONSENSUS_DECISIONS[CONSENSUS_K] = [
-                    {
-                        "server": NODE_ID,
-                        "decided": set(),
-                        "k": CONSENSUS_K,
-                    }
-                ]
-                add_to_consensus_decision_buffer(
-                    {
-                        "server": NODE_ID,
-                        "decided": [],
-                        "k": CONSENSUS_K,
-                    }
-                )
-            APPLYING_CONSENSUS = True
-
-        await asyncio.sleep(0.001)
+            log_record(
+                {
+                    "t": "decide",
+                    "server": NODE_ID,
+                    "k": k,
+                    "decided": [list(d) for d in decided],
+                }
+            )
+            decisions[k] = decided
+        if not decisions:
+            continue
+        # neither applied nor sent until a restart would decide the same;
+        # k cannot be applied or collected without this node's decision
+        await make_durable()
+        for k, decided in decisions.items():
+            DELIVERED_CONSENSUS_DECISIONS.setdefault(k, {})[NODE_ID] = set(
+                tuple(msg) for msg in decided
+            )
+            add_to_consensus_decision_buffer(
+                {
+                    "server": NODE_ID,
+                    "decided": [list(d) for d in decided],
+                    "k": k,
+                    "applied": APPLIED_CONSENSUS_K,
+                }
+            )
+            DECIDED_CONSENSUS_K.add(k)
+        notify(DECISIONS_READY)
 
 
 async def apply_consensus_decisions():
     logger.info("Applying consensus decisions task started.")
-    global UNORDERED_MESSAGES, DELIVERED_CONSENSUS_DECISIONS, DECIDING_CONSENSUS, ORDERED_MESSAGES, APPLYING_CONSENSUS
+    global UNORDERED_MESSAGES, DELIVERED_CONSENSUS_DECISIONS, ORDERED_MESSAGES, APPLIED_CONSENSUS_K
     while True:
-        if APPLYING_CONSENSUS and len(DELIVERED_CONSENSUS_DECISIONS[CONSENSUS_K]) >= (
-            NO_NODES / 2
+        await wait_for(DECISIONS_READY)
+        # instances may decide out of order but are applied in k order
+        while (
+            APPLIED_CONSENSUS_K + 1 in DECIDED_CONSENSUS_K
+            and len(DELIVERED_CONSENSUS_DECISIONS[APPLIED_CONSENSUS_K + 1])
+            >= (NO_NODES / 2)
         ):
-            logger.info("Applying consensus decision for k: %s", CONSENSUS_K)
-            decisions = [
-                d["decided"] for d in DELIVERED_CONSENSUS_DECISIONS[CONSENSUS_K]
-            ]
+            k = APPLIED_CONSENSUS_K + 1
+            logger.info("Applying consensus decision for k: %s", k)
+            decisions = list(DELIVERED_CONSENSUS_DECISIONS[k].values())
             req_ids = list(set.intersection(*decisions))
             req_ids.sort()  # deterministic ordering
             for req_id in req_ids:
                 if req_id in UNORDERED_MESSAGES:
                     UNORDERED_MESSAGES.remove(req_id)
                     ORDERED_MESSAGES.append(req_id)
-            DECIDING_CONSENSUS = False
-            APPLYING_CONSENSUS = False
-        await asyncio.sleep(0.001)
+            PROPOSED_MESSAGES.pop(k, None)
+            DECIDED_CONSENSUS_K.discard(k)
+            APPLIED_CONSENSUS_K = k
+            collect_consensus_garbage()
+            notify(ORDERED_READY, UNORDERED_READY)
 
 
 def commit(r: Request):
-    global TENTATIVE, COMMITTED
+    global LOG, PLANNER, STATE
     logger.info("Committing request %s", r.id)
-    committed_ext = [x for x in TENTATIVE if x.id in r.causal_ctx]
-    new_tentative = [x for x in TENTATIVE if x not in committed_ext and x != r]
-    COMMITTED.extend(committed_ext + [r])
-    TENTATIVE = new_tentative
-    new_order = COMMITTED + TENTATIVE
-    adjust_execution(new_order)
+    committed_ext = [x for x in LOG.tentative_in(r.causal_ctx) if x != r]
+    PLANNER.commit(committed_ext + [r])
+    PLANNER.plan()
+    notify(ROLLBACK_READY, EXECUTE_READY)
+    for x in committed_ext + [r]:
+        if PLANNER.is_executed(x):
+            STATE.commit(x)
+            # still executed after the commit, so its prefix did not change
+            if x.id in TENTATIVE_RESULTS and x.id in REQUEST_AWAITING_RESP:
+                note_result(x, TENTATIVE_RESULTS.pop(x.id), True)
     # strong_ops_to_check = [x for x in committed_ext + r if x.strong_op]
     # for op in strong_ops_to_check:
     #     pass
 
 
 def CAB_deliver(req_id):
-    global TENTATIVE
+    global LOG
     logger.info("CAB_deliver called for message %s", req_id)
-    req = [x for x in TENTATIVE if x.id == req_id]
-    if not req:
+    r = LOG.get(req_id)
+    if r is None or LOG.is_committed(req_id):
         return
-    r = req[0]
     commit(r)
 
 
@@ -304,7 +523,8 @@ async def process_ordered_messages():
     logger.info("Processing ordered messages task started.")
     global ORDERED_MESSAGES, RECEIVED
     while True:
-        if (
+        await wait_for(ORDERED_READY)
+        while (
             ORDERED_MESSAGES
             and ORDERED_MESSAGES[0] in RECEIVED
             and predicate_check_dep(ORDERED_MESSAGES[0])
@@ -312,18 +532,18 @@ async def process_ordered_messages():
             req_id = ORDERED_MESSAGES.pop(0)
             logger.info("Processing ordered message %s", req_id)
             CAB_deliver(req_id)
-        await asyncio.sleep(0.001)
 
 
 async def print_status():
     logger.info("Status task started")
     while True:
         logger.info("\n------------------Current status:--------------------")
-        logger.info("COMMITTED: %s", [r.id for r in COMMITTED])
-        logger.info("TENTATIVE: %s", [r.id for r in TENTATIVE])
-        logger.info("EXECUTED: %s", [r.id for r in EXECUTED])
-        logger.info("TO_BE_EXECUTED: %s", [r.id for r in TO_BE_EXECUTED])
-        logger.info("TO_BE_ROLLEDBACK: %s", [r.id for r in TO_BE_ROLLEDBACK])
+        logger.info("COMMITTED: %s", [r.id for r in LOG.committed])
+        logger.info("TENTATIVE: %s", [r.id for r in LOG.tentative])
+        logger.info("EXECUTED: %s", [r.id for r in PLANNER.executed])
+        logger.info("TO_BE_EXECUTED: %s", [r.id for r in PLANNER.to_be_executed])
+        logger.info("TO_BE_ROLLEDBACK: %s", [r.id for r in PLANNER.to_be_rolledback])
+        logger.info("PLANNER: %s", PLANNER)
         logger.info("DELIVERED: %s", DELIVERED)
         logger.info("CAUSAL_CTX: %s", CAUSAL_CTX)
         logger.info("MISSING_CONTEXT_OPS: %s", [r.id for r in MISSING_CONTEXT_OPS])
@@ -333,15 +553,64 @@ async def print_status():
         logger.info("DELIVERED_CONSENSUS_PROPOSALS: %s", DELIVERED_CONSENSUS_PROPOSALS)
         logger.info("DELIVERED_CONSENSUS_DECISIONS: %s", DELIVERED_CONSENSUS_DECISIONS)
         logger.info("CONSENSUS_K: %s", CONSENSUS_K)
-        logger.info("DECIDING_CONSENSUS: %s", DECIDING_CONSENSUS)
-        logger.info("APPLYING_CONSENSUS: %s", APPLYING_CONSENSUS)
+        logger.info("APPLIED_CONSENSUS_K: %s", APPLIED_CONSENSUS_K)
+        logger.info("DECIDED_CONSENSUS_K: %s", DECIDED_CONSENSUS_K)
         logger.info("STATE: %s", STATE)
         logger.info("\n------------------------End--------------------------\n")
         await asyncio.sleep(10)
 
 
+async def sample_backlog():
+    global QUEUE_BACKLOG
+    queues = [
+        BUFFER_QUEUE,
+        CAB_BUFFER_QUEUE,
+        CONSENSUS_PROPOSAL_QUEUE,
+        CONSENSUS_DECISION_QUEUE,
+    ]
+    while True:
+        try:
+            QUEUE_BACKLOG = await r.backlog(queues)
+        except Exception as e:
+            logger.info("Sampling queue backlog failed: %s", e)
+        await asyncio.sleep(ADMISSION_SAMPLE_MS / 1000)
+
+
+def admission_signals():
+    return {
+        "tentative": len(LOG.tentative),
+        "execution_lag": len(PLANNER.to_be_executed) + len(PLANNER.to_be_rolledback),
+        "gossip_backlog": QUEUE_BACKLOG.get(BUFFER_QUEUE, 0)
+        + QUEUE_BACKLOG.get(CAB_BUFFER_QUEUE, 0),
+        "consensus_backlog": QUEUE_BACKLOG.get(CONSENSUS_PROPOSAL_QUEUE, 0)
+        + QUEUE_BACKLOG.get(CONSENSUS_DECISION_QUEUE, 0)
+        + CONSENSUS_K
+        - APPLIED_CONSENSUS_K,
+        "unordered": len(UNORDERED_MESSAGES),
+        "waiting": len(REQUEST_AWAITING_RESP),
+    }
+
+
+def admit(strong_op: bool):
+    # None to go ahead, else the response that sheds the request
+    if WAL is not None and WAL.failed is not None:
+        return JSONResponse(status_code=503, content={"detail": "Write-ahead log failed"})
+    rejection = ADMISSION.check(strong_op, admission_signals())
+    if rejection is None:
+        return None
+    status, reason, retry = rejection
+    op_class = "strong" if strong_op else "weak"
+    logger.info("Rejecting %s op with %s: %s", op_class, status, reason)
+    return JSONResponse(
+        status_code=status,
+        content={"detail": reason, "retry_after_ms": int(retry * 1000)},
+        headers={"Retry-After": retry_after_header(retry)},
+    )
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    recover()
     tasks = [
         asyncio.create_task(rollback()),
         asyncio.create_task(execute()),
@@ -350,74 +619,290 @@ async def lifespan(app: FastAPI):
         asyncio.create_task(apply_consensus_decisions()),
         asyncio.create_task(process_ordered_messages()),
         asyncio.create_task(print_status()),
+        asyncio.create_task(sample_backlog()),
     ]
+    if WAL is not None:
+        tasks.append(asyncio.create_task(take_snapshots()))
+    elif STATE.storage.persisted_segment() is not None:
+        tasks.append(asyncio.create_task(flush_storage()))
+    app.state.client = get_http_client()
+    if ANTI_ENTROPY_INTERVAL > 0:
+        tasks.append(asyncio.create_task(anti_entropy(app.state.client)))
+    if IN_PROCESS:
+        import gossiping
+        import consensus
+
+        tasks.append(asyncio.create_task(gossiping.run(r, app.state.client)))
+        tasks.append(asyncio.create_task(consensus.run(r, app.state.client)))
     yield
     for t in tasks:
         t.cancel()
     await asyncio.gather(*tasks, return_exceptions=True)
+    await r.aclose()
     await app.state.client.aclose()
+    if WAL is not None:
+        if WAL.failed is None:
+            await WAL.sync()
+        WAL.close()
+    STATE.storage.close()
 
 
 app = FastAPI(lifespan=lifespan)
 
 
+@app.exception_handler(WALError)
+async def wal_failed(request: HTTPRequest, e: WALError):
+    return JSONResponse(status_code=503, content={"detail": "Write-ahead log failed"})
+
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "committed": len(LOG.committed),
+        "tentative": len(LOG.tentative),
+        "rolled_back": PLANNER.rolledback_count,
+        "rejected_weak": ADMISSION.rejected["weak"],
+        "rejected_strong": ADMISSION.rejected["strong"],
+    }
+
+
+def peer_message(model):
+    # peers send either JSON or the binary wire format
+    async def parse(request: HTTPRequest):
+        body = await request.body()
+        content_type = request.headers.get("content-type", "")
+        try:
+            if content_type == wire.CONTENT_TYPE:
+                return model.model_validate(wire.decode(body)[1])
+            if not content_type or content_type.startswith("application/json"):
+                return model.model_validate_json(body)
+        except (wire.WireError, ValidationError) as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        raise HTTPException(status_code=415, detail=f"Unsupported {content_type}")
+
+    return Depends(parse)
+
+
 @app.post("/invoke")
 async def invoke(request: InvokeRequestModel):
-    global CURR_EVENT_NO, CAUSAL_CTX, REQUEST_AWAITING_RESP, TENTATIVE
+    # weak reads never queue anything, so they are always admitted
+    if not is_local_read(request):
+        rejected = admit(request.strong_op)
+        if rejected is not None:
+            return rejected
+    return await submit(request)
+
+
+def is_local_read(request: InvokeRequestModel):
+    return not request.strong_op and request.op[:1] in (["GET"], ["MGET"])
+
+
+async def submit(request: InvokeRequestModel):
+    global CURR_EVENT_NO, CAUSAL_CTX, REQUEST_AWAITING_RESP, LOG
+    check_wal()
+    if is_local_read(request):
+        # weak reads are served from the local state and never replicated
+        op = Operation(*request.op)
+        await STATE.prefetch([op])
+        return {"result": STATE.read_op(op), "node_id": NODE_ID}
     CURR_EVENT_NO += 1
     r = Request(
+        ts=CLOCK.now(),
         id=(NODE_ID, CURR_EVENT_NO),
         op=request.op,
         strong_op=request.strong_op,
         causal_ctx=[],
     )
     if r.strong_op:
-        r.causal_ctx = CAUSAL_CTX - {x.id for x in TENTATIVE if r < x}
-        CAB_cast(r.id, "check_dep")
+        r.causal_ctx = CAUSAL_CTX - {x.id for x in LOG.tentative_after(r)}
     CAUSAL_CTX.add(r.id)
-    RB_cast(r)
-    insert_into_tentative({r})
-    REQUEST_AWAITING_RESP[r.id] = None
-    return {"event_no": CURR_EVENT_NO, "node_id": NODE_ID}
+    mark_delivered(r)
+    log_record({"t": "req", "req": r.to_json()})
+    if request.wait:
+        REQUEST_AWAITING_RESP[r.id] = asyncio.get_running_loop().create_future()
+    try:
+        insert_into_tentative({r})
+        if r.strong_op:
+            msg = CAB_cast(r.id, "check_dep")
+        # a restart hands out event numbers again from the log, so peers must
+        # not see one the log does not have yet
+        await make_durable()
+        if r.strong_op:
+            CAB_send(msg)
+        RB_cast(r)
+        response = {"event_no": r.id[1], "node_id": NODE_ID}
+        if not request.wait:
+            return response
+        timeout = INVOKE_TIMEOUT if request.timeout is None else request.timeout
+        try:
+            result, committed = await asyncio.wait_for(
+                REQUEST_AWAITING_RESP[r.id], timeout
+            )
+            response.update(result=result, committed=committed)
+        except asyncio.TimeoutError:
+            response.update(timed_out=True)
+        return response
+    finally:
+        REQUEST_AWAITING_RESP.pop(r.id, None)
+        TENTATIVE_RESULTS.pop(r.id, None)
+
+
+@app.post("/invoke-batch")
+async def invoke_batch(request: InvokeBatchModel):
+    # requests get consecutive event numbers in the order given and share
+    # the WAL sync and the gossip batch; the batch is admitted or shed whole
+    for strong_op in {x.strong_op for x in request.requests if not is_local_read(x)}:
+        rejected = admit(strong_op)
+        if rejected is not None:
+            return rejected
+    responses = await asyncio.gather(*[submit(x) for x in request.requests])
+    return {"responses": responses}
+
+
+def accept_gossip(request: GossipModel, forward=True):
+    global DELIVERED
+    if tuple(request.id) in DELIVERED:
+        return None
+    CLOCK.update(request.ts)
+    r = Request(
+        ts=request.ts,
+        id=request.id,
+        op=request.op,
+        strong_op=request.strong_op,
+        causal_ctx=request.causal_ctx,
+    )
+    if forward:
+        add_to_buffer(r.to_json())
+    mark_delivered(r)
+    log_record({"t": "req", "req": r.to_json()})
+    return r
+
+
+def accept_gossip_cab(request: GossipCABModel, forward=True):
+    global DELIVERED_CAB
+    if tuple(request.m) in DELIVERED_CAB:
+        return None
+    msg = Message(
+        m=request.m,
+        q=request.q,
+    )
+    if forward:
+        add_to_cab_buffer(msg.to_json())
+    DELIVERED_CAB.add(msg.m)
+    log_record({"t": "msg", "msg": msg.to_json()})
+    return msg
 
 
 @app.post("/gossip")
-async def gossip(request: GossipModel):
-    global DELIVERED
+async def gossip(request: GossipModel = peer_message(GossipModel)):
     logger.info("Received gossip for request %s", request.id)
-    if tuple(request.id) not in DELIVERED:
-        r = Request(
-            ts=request.ts,
-            id=request.id,
-            op=request.op,
-            strong_op=request.strong_op,
-            causal_ctx=[tuple(c) for c in request.causal_ctx],
-        )
-        add_to_buffer(r.to_json())
-        DELIVERED.add(r.id)
-        RB_deliver(r)
+    r = accept_gossip(request)
+    if r is not None:
+        RB_deliver([r])
+        await make_durable()
         return {"msg": "Added to buffer"}
     return {"msg": "Already delivered"}
 
 
+@app.post("/gossip-batch")
+async def gossip_batch(request: GossipBatchModel = peer_message(GossipBatchModel)):
+    logger.info("Received gossip batch of %s requests", len(request.requests))
+    delivered = [accept_gossip(g) for g in request.requests]
+    delivered = [r for r in delivered if r is not None]
+    RB_deliver(delivered)
+    await make_durable()
+    return {
+        "msg": "Added to buffer",
+        "delivered": len(delivered),
+        "duplicates": len(request.requests) - len(delivered),
+    }
+
+
 @app.post("/gossip-cab")
-async def gossip_cab(request: GossipCABModel):
-    global DELIVERED_CAB
+async def gossip_cab(request: GossipCABModel = peer_message(GossipCABModel)):
     logger.info("Received gossip message for request %s", request.m)
-    if tuple(request.m) not in DELIVERED_CAB:
-        msg = Message(
-            m=request.m,
-            q=request.q,
-        )
-        add_to_cab_buffer(msg.to_json())
-        DELIVERED_CAB.add(msg.m)
+    msg = accept_gossip_cab(request)
+    if msg is not None:
         RB_deliver_msg(msg)
+        await make_durable()
         return {"msg": "Added to buffer"}
     return {"msg": "Already delivered"}
 
 
+@app.post("/gossip-cab-batch")
+async def gossip_cab_batch(
+    request: GossipCABBatchModel = peer_message(GossipCABBatchModel),
+):
+    logger.info("Received gossip batch of %s messages", len(request.messages))
+    delivered = [accept_gossip_cab(g) for g in request.messages]
+    delivered = [msg for msg in delivered if msg is not None]
+    for msg in delivered:
+        RB_deliver_msg(msg)
+    await make_durable()
+    return {
+        "msg": "Added to buffer",
+        "delivered": len(delivered),
+        "duplicates": len(request.messages) - len(delivered),
+    }
+
+
+@app.post("/sync")
+async def sync_missing(request: SyncRequestModel, http_request: HTTPRequest):
+    # requests and CAB messages this node delivered that the requester has
+    # not, so the response grows with the gap rather than the history
+    check_wal()
+    delivered = WatermarkSet.from_json(request.delivered)
+    delivered_cab = WatermarkSet.from_json(request.delivered_cab)
+    requests = []
+    for req_id in DELIVERED.difference(delivered):
+        if len(requests) >= request.limit:
+            break
+        r = LOG.get(req_id) or MISSING_CONTEXT_OPS.get(req_id)
+        if r is not None:
+            requests.append(r.to_json())
+    messages = []
+    for m in DELIVERED_CAB.difference(delivered_cab):
+        if len(messages) >= request.limit:
+            break
+        r = LOG.get(m)
+        if r is not None and not r.strong_op:
+            # the id of a weak op, see mark_delivered
+            continue
+        # check_dep is the only kind of CAB message
+        messages.append(Message(m, "check_dep").to_json())
+    # consensus messages of the instances the requester has not applied; a
+    # node that missed them for longer than the senders retry could not
+    # decide or apply them otherwise. Instances are only collected once
+    # every node applied them, so they are still here.
+    proposals = [
+        {"server": server, "k": k, "unordered": [list(m) for m in msgs]}
+        for k, by_server in DELIVERED_CONSENSUS_PROPOSALS.items()
+        if k > request.applied_k
+        for server, msgs in by_server.items()
+    ]
+    decisions = [
+        {"server": server, "k": k, "decided": [list(m) for m in msgs]}
+        for k, by_server in DELIVERED_CONSENSUS_DECISIONS.items()
+        if k > request.applied_k
+        for server, msgs in by_server.items()
+    ]
+    data = {
+        "requests": requests,
+        "messages": messages,
+        "more": len(requests) >= request.limit or len(messages) >= request.limit,
+        "proposals": proposals,
+        "decisions": decisions,
+    }
+    if http_request.headers.get("accept") == wire.CONTENT_TYPE:
+        return Response(
+            content=wire.encode(wire.SYNC_RESPONSE, data),
+            media_type=wire.CONTENT_TYPE,
+        )
+    return data
+
+
 @app.post("/propose-cab")
-async def propose_cab(request: ProposeCABModel):
+async def propose_cab(request: ProposeCABModel = peer_message(ProposeCABModel)):
     global DELIVERED_CONSENSUS_PROPOSALS
     logger.info(
         "Received proposal message with params. Server: %s, Unordered: %s, k: %s",
@@ -427,26 +912,33 @@ async def propose_cab(request: ProposeCABModel):
     )
     k = request.k
     server = request.server
+    note_applied_consensus(server, request.applied)
+    if k <= CONSENSUS_GC_K or server in DELIVERED_CONSENSUS_PROPOSALS.get(k, {}):
+        logger.info("Proposal with k: %s already delivered", request.k)
+        return {"msg": "Already delivered"}
     unordered = set(tuple(u) for u in request.unordered)
-    if request.k in DELIVERED_CONSENSUS_PROPOSALS:
-        if [
-            i for i in DELIVERED_CONSENSUS_PROPOSALS[request.k] if i["server"] == server
-        ]:
-            logger.info("Proposal with k: %s already delivered", request.k)
-            return {"msg": "Already delivered"}
-        else:
-            DELIVERED_CONSENSUS_PROPOSALS[request.k].append(
-                {"k": k, "server": server, "unordered": unordered}
-            )
-    else:
-        DELIVERED_CONSENSUS_PROPOSALS[request.k] = [
-            {"k": k, "server": server, "unordered": unordered}
-        ]
+    if request.base is not None:
+        # delta against the proposal the same server made for instance base
+        base = proposal_of(server, request.base)
+        if base is None:
+            return {"msg": "Missing base"}
+        unordered |= base - set(tuple(u) for u in request.removed)
+    deliver_proposal(server, k, unordered)
+    log_record(
+        {
+            "t": "propose",
+            "server": server,
+            "k": k,
+            "unordered": [list(u) for u in unordered],
+        }
+    )
+    notify(PROPOSALS_READY)
+    await make_durable()
     return {"msg": "Received"}
 
 
 @app.post("/decide-cab")
-async def decide_cab(request: DecideCABModel):
+async def decide_cab(request: DecideCABModel = peer_message(DecideCABModel)):
     global DELIVERED_CONSENSUS_DECISIONS
     logger.info(
         "Received decision message with params. Server: %s, Decided: %s, k: %s",
@@ -456,49 +948,381 @@ async def decide_cab(request: DecideCABModel):
     )
     k = request.k
     server = request.server
+    note_applied_consensus(server, request.applied)
+    if k <= CONSENSUS_GC_K or server in DELIVERED_CONSENSUS_DECISIONS.get(k, {}):
+        logger.info("Decision with k: %s already delivered", request.k)
+        return {"msg": "Already delivered"}
     decided = set(tuple(d) for d in request.decided)
-    if request.k in DELIVERED_CONSENSUS_DECISIONS:
-        if [
-            i for i in DELIVERED_CONSENSUS_DECISIONS[request.k] if i["server"] == server
-        ]:
-            logger.info("Decision with k: %s already delivered", request.k)
-            return {"msg": "Already delivered"}
-        else:
-            DELIVERED_CONSENSUS_DECISIONS[request.k].append(
-                {"k": k, "server": server, "decided": decided}
-            )
-    else:
-        DELIVERED_CONSENSUS_DECISIONS[request.k] = [
-            {"k": k, "server": server, "decided": decided}
-        ]
+    DELIVERED_CONSENSUS_DECISIONS.setdefault(k, {})[server] = decided
+    log_record(
+        {"t": "decide", "server": server, "k": k, "decided": [list(d) for d in decided]}
+    )
+    notify(DECISIONS_READY)
+    await make_durable()
     return {"msg": "Received"}
 
 
-def insert_into_tentative(ready_to_schedule_ops):
-    global TENTATIVE, COMMITTED
-    for r in ready_to_schedule_ops:
-        previous = [x for x in TENTATIVE if x < r]
-        subsequent = [x for x in TENTATIVE if r < x]
-        TENTATIVE = previous + [r] + subsequent
+def proposal_of(server: int, k: int):
+    latest = LATEST_PROPOSALS.get(server)
+    if latest is not None and latest[0] == k:
+        return latest[1]
+    return DELIVERED_CONSENSUS_PROPOSALS.get(k, {}).get(server)
 
-    new_order = COMMITTED + TENTATIVE
-    adjust_execution(new_order)
 
+def deliver_proposal(server: int, k: int, unordered: set):
+    DELIVERED_CONSENSUS_PROPOSALS.setdefault(k, {})[server] = unordered
+    if server not in LATEST_PROPOSALS or LATEST_PROPOSALS[server][0] < k:
+        LATEST_PROPOSALS[server] = (k, unordered)
 
-def adjust_execution(new_order: list[Request]):
-    global COMMITTED, EXECUTED, TO_BE_EXECUTED, TO_BE_ROLLEDBACK
-    in_order = longest_common_prefix(COMMITTED, new_order)
-    out_of_order = [x for x in EXECUTED if x not in in_order]
-    EXECUTED = in_order
-    TO_BE_EXECUTED = [x for x in new_order if x not in EXECUTED]
-    TO_BE_ROLLEDBACK = out_of_order[::-1]
 
+def note_applied_consensus(server: int, applied: int):
+    global PEER_APPLIED_CONSENSUS_K
+    if applied > PEER_APPLIED_CONSENSUS_K.get(server, 0):
+        PEER_APPLIED_CONSENSUS_K[server] = applied
+        collect_consensus_garbage()
 
-def longest_common_prefix(list1: list[Request], list2: list[Request]) -> list[Request]:
-    common_prefix = []
-    for a, b in zip(list1, list2):
-        if a == b:
-            common_prefix.append(a)
+
+def collect_consensus_garbage():
+    # instances every node has applied will never be proposed or decided again
+    global CONSENSUS_GC_K, DELIVERED_CONSENSUS_PROPOSALS, DELIVERED_CONSENSUS_DECISIONS
+    horizon = min(
+        [APPLIED_CONSENSUS_K]
+        + [PEER_APPLIED_CONSENSUS_K.get(i, 0) for i in range(NO_NODES) if i != NODE_ID]
+    )
+    for k in range(CONSENSUS_GC_K + 1, horizon + 1):
+        DELIVERED_CONSENSUS_PROPOSALS.pop(k, None)
+        DELIVERED_CONSENSUS_DECISIONS.pop(k, None)
+    CONSENSUS_GC_K = max(CONSENSUS_GC_K, horizon)
+
+
+def insert_into_tentative(ready_to_schedule_ops):
+    global LOG, PLANNER
+    for r in ready_to_schedule_ops:
+        PLANNER.insert(r)
+
+    PLANNER.plan()
+    notify(ROLLBACK_READY, EXECUTE_READY, ORDERED_READY)
+
+
+def snapshot_state():
+    # the committed values cover the committed ops that were executed; the
+    # rest of the committed prefix is executed again after a restore. A
+    # storage engine that keeps them in its own file returns no "db" and
+    # writes them when the checkpoint persists.
+    snapshot = {
+        "event_no": CURR_EVENT_NO,
+        "committed": [x.to_json() for x in LOG.committed],
+        "unexecuted": [
+            list(x.id) for x in LOG.committed if not PLANNER.is_executed(x)
+        ],
+        "tentative": [x.to_json() for x in LOG.tentative],
+        "missing": [x.to_json() for x in MISSING_CONTEXT_OPS],
+        "causal_ctx": CAUSAL_CTX.to_json(),
+        "delivered": DELIVERED.to_json(),
+        "delivered_cab": DELIVERED_CAB.to_json(),
+        "received": RECEIVED.to_json(),
+        "ordered": [list(m) for m in ORDERED_MESSAGES],
+        "unordered": [list(m) for m in UNORDERED_MESSAGES],
+        "consensus_k": CONSENSUS_K,
+        "applied_consensus_k": APPLIED_CONSENSUS_K,
+        "consensus_gc_k": CONSENSUS_GC_K,
+        "decided_consensus_k": sorted(DECIDED_CONSENSUS_K),
+        "proposed": [[k, [list(m) for m in msgs]] for k, msgs in PROPOSED_MESSAGES.items()],
+        "proposals": [
+            [k, server, [list(m) for m in msgs]]
+            for k, by_server in DELIVERED_CONSENSUS_PROPOSALS.items()
+            for server, msgs in by_server.items()
+        ],
+        "decisions": [
+            [k, server, [list(m) for m in msgs]]
+            for k, by_server in DELIVERED_CONSENSUS_DECISIONS.items()
+            for server, msgs in by_server.items()
+        ],
+        "peer_applied_consensus_k": list(PEER_APPLIED_CONSENSUS_K.items()),
+        "latest_proposals": [
+            [server, k, [list(m) for m in msgs]]
+            for server, (k, msgs) in LATEST_PROPOSALS.items()
+        ],
+    }
+    db = STATE.storage.snapshot()
+    if db is not None:
+        snapshot["db"] = db
+    return snapshot
+
+
+def restore(snapshot: dict):
+    global CURR_EVENT_NO, CAUSAL_CTX, DELIVERED, DELIVERED_CAB, RECEIVED
+    global ORDERED_MESSAGES, UNORDERED_MESSAGES, CONSENSUS_K, APPLIED_CONSENSUS_K
+    global CONSENSUS_GC_K, DECIDED_CONSENSUS_K, PROPOSED_MESSAGES
+    global DELIVERED_CONSENSUS_PROPOSALS, DELIVERED_CONSENSUS_DECISIONS
+    global PEER_APPLIED_CONSENSUS_K, LATEST_PROPOSALS
+    CURR_EVENT_NO = snapshot["event_no"]
+    committed = [Request.from_json(x) for x in snapshot["committed"]]
+    for x in committed:
+        CLOCK.update(x.ts)
+        LOG.insert(x)
+    LOG.commit(committed)
+    unexecuted = set(tuple(x) for x in snapshot.get("unexecuted", []))
+    for x in LOG.committed:
+        if x.id not in unexecuted:
+            PLANNER.mark_executed(x)
+    pending = [x for x in LOG.committed if x.id in unexecuted]
+    if pending:
+        PLANNER.invalidate(LOG.position(pending[0]), pending)
+        PLANNER.plan()
+    if "db" in snapshot:
+        STATE.restore((k, v) for k, v in snapshot["db"])
+    CAUSAL_CTX = VersionVector.from_json(snapshot["causal_ctx"])
+    DELIVERED = WatermarkSet.from_json(snapshot["delivered"])
+    DELIVERED_CAB = WatermarkSet.from_json(snapshot["delivered_cab"])
+    RECEIVED = WatermarkSet.from_json(snapshot["received"])
+    # tentative ops are executed again on top of the committed state
+    tentative = {Request.from_json(x) for x in snapshot["tentative"]}
+    for x in tentative:
+        CLOCK.update(x.ts)
+    if tentative:
+        insert_into_tentative(tentative)
+    for x in snapshot["missing"]:
+        x = Request.from_json(x)
+        MISSING_CONTEXT_OPS.park(x, list(x.causal_ctx.difference(CAUSAL_CTX)))
+    ORDERED_MESSAGES = [tuple(m) for m in snapshot["ordered"]]
+    UNORDERED_MESSAGES = set(tuple(m) for m in snapshot["unordered"])
+    CONSENSUS_K = snapshot["consensus_k"]
+    APPLIED_CONSENSUS_K = snapshot["applied_consensus_k"]
+    CONSENSUS_GC_K = snapshot["consensus_gc_k"]
+    DECIDED_CONSENSUS_K = set(snapshot["decided_consensus_k"])
+    PROPOSED_MESSAGES = {
+        k: set(tuple(m) for m in msgs) for k, msgs in snapshot["proposed"]
+    }
+    DELIVERED_CONSENSUS_PROPOSALS = {}
+    for k, server, msgs in snapshot["proposals"]:
+        DELIVERED_CONSENSUS_PROPOSALS.setdefault(k, {})[server] = set(
+            tuple(m) for m in msgs
+        )
+    DELIVERED_CONSENSUS_DECISIONS = {}
+    for k, server, msgs in snapshot["decisions"]:
+        DELIVERED_CONSENSUS_DECISIONS.setdefault(k, {})[server] = set(
+            tuple(m) for m in msgs
+        )
+    PEER_APPLIED_CONSENSUS_K = {
+        server: k for server, k in snapshot["peer_applied_consensus_k"]
+    }
+    LATEST_PROPOSALS = {
+        server: (k, set(tuple(m) for m in msgs))
+        for server, k, msgs in snapshot.get("latest_proposals", [])
+    }
+
+
+def replay(record: dict):
+    # redoes the state change of a logged input without sending anything
+    global CURR_EVENT_NO, CONSENSUS_K
+    if record["t"] == "req":
+        r = Request.from_json(record["req"])
+        CLOCK.update(r.ts)
+        if r.id in DELIVERED:
+            return
+        mark_delivered(r)
+        if r.id[0] == NODE_ID:
+            CURR_EVENT_NO = max(CURR_EVENT_NO, r.id[1])
+            CAUSAL_CTX.add(r.id)
+            insert_into_tentative({r})
         else:
-            break
-    return common_prefix
+            RB_deliver([r])
+    elif record["t"] == "msg":
+        msg = Message(**record["msg"])
+        if msg.m in DELIVERED_CAB:
+            return
+        DELIVERED_CAB.add(msg.m)
+        RB_deliver_msg(msg)
+    elif record["t"] == "propose":
+        k, server = record["k"], record["server"]
+        if k <= CONSENSUS_GC_K:
+            return
+        unordered = set(tuple(m) for m in record["unordered"])
+        deliver_proposal(server, k, unordered)
+        if server == NODE_ID and k > APPLIED_CONSENSUS_K:
+            CONSENSUS_K = max(CONSENSUS_K, k)
+            PROPOSED_MESSAGES[k] = set(unordered)
+        notify(PROPOSALS_READY)
+    elif record["t"] == "decide":
+        k, server = record["k"], record["server"]
+        if k <= CONSENSUS_GC_K:
+            return
+        decided = set(tuple(d) for d in record["decided"])
+        DELIVERED_CONSENSUS_DECISIONS.setdefault(k, {})[server] = decided
+        if server == NODE_ID and k > APPLIED_CONSENSUS_K:
+            DECIDED_CONSENSUS_K.add(k)
+        notify(DECISIONS_READY)
+
+
+def recover():
+    if WAL is None:
+        # nothing to replay, so committed values left by an earlier run
+        # would not match the log
+        STATE.restore([])
+        return
+    persisted = STATE.storage.persisted_segment()
+    snapshot, records = WAL.load(persisted)
+    if snapshot is None:
+        if persisted:
+            raise RuntimeError(f"{STATE.storage} is newer than the WAL in {WAL_DIR}")
+        STATE.restore([])
+    else:
+        if "db" not in snapshot and snapshot["segment"] != persisted:
+            raise RuntimeError(
+                f"{STATE.storage} does not match the snapshot of segment {snapshot['segment']}"
+            )
+        restore(snapshot)
+    for record in records:
+        replay(record)
+    # peers may not have received this node's part in the open instances
+    for k in range(APPLIED_CONSENSUS_K + 1, CONSENSUS_K + 1):
+        proposal = DELIVERED_CONSENSUS_PROPOSALS.get(k, {}).get(NODE_ID)
+        if proposal is not None:
+            add_to_consensus_proposal_buffer(
+                {
+                    "server": NODE_ID,
+                    "unordered": [list(msg) for msg in proposal],
+                    "k": k,
+                    "applied": APPLIED_CONSENSUS_K,
+                }
+            )
+        decision = DELIVERED_CONSENSUS_DECISIONS.get(k, {}).get(NODE_ID)
+        if decision is not None and k in DECIDED_CONSENSUS_K:
+            add_to_consensus_decision_buffer(
+                {
+                    "server": NODE_ID,
+                    "decided": [list(d) for d in decision],
+                    "k": k,
+                    "applied": APPLIED_CONSENSUS_K,
+                }
+            )
+    # the CAB message of an own strong op is logged with its request and
+    # sent once both are durable, so a crash may have left it unsent, or
+    # unlogged if the write was torn between the two records
+    for x in LOG.tentative:
+        if x.id[0] == NODE_ID and x.strong_op:
+            if x.id in DELIVERED_CAB:
+                CAB_send(Message(x.id, "check_dep"))
+            else:
+                CAB_send(CAB_cast(x.id, "check_dep"))
+    notify(ROLLBACK_READY, EXECUTE_READY, UNORDERED_READY, ORDERED_READY)
+    logger.info(
+        "Recovered from %s with %s WAL records: %s",
+        "snapshot" if snapshot is not None else "empty state",
+        len(records),
+        LOG,
+    )
+
+
+def parse_synced(model, items: list) -> list:
+    parsed = []
+    for x in items:
+        try:
+            parsed.append(model(**x))
+        except ValidationError as e:
+            logger.info("Skipping malformed synced item %s: %s", x, e)
+    return parsed
+
+
+def apply_sync(data: dict) -> int:
+    delivered = [
+        accept_gossip(g, forward=False)
+        for g in parse_synced(GossipModel, data["requests"])
+    ]
+    delivered = [r for r in delivered if r is not None]
+    RB_deliver(delivered)
+    messages = [
+        accept_gossip_cab(g, forward=False)
+        for g in parse_synced(GossipCABModel, data["messages"])
+    ]
+    messages = [msg for msg in messages if msg is not None]
+    for msg in messages:
+        RB_deliver_msg(msg)
+    # this node's own proposals and decisions are only made by itself
+    proposals = 0
+    for p in parse_synced(ProposeCABModel, data.get("proposals", [])):
+        if p.server == NODE_ID or p.k <= CONSENSUS_GC_K:
+            continue
+        if p.server in DELIVERED_CONSENSUS_PROPOSALS.get(p.k, {}):
+            continue
+        unordered = set(tuple(u) for u in p.unordered)
+        deliver_proposal(p.server, p.k, unordered)
+        log_record(
+            {"t": "propose", "server": p.server, "k": p.k, "unordered": p.unordered}
+        )
+        proposals += 1
+    decisions = 0
+    for d in parse_synced(DecideCABModel, data.get("decisions", [])):
+        if d.server == NODE_ID or d.k <= CONSENSUS_GC_K:
+            continue
+        if d.server in DELIVERED_CONSENSUS_DECISIONS.get(d.k, {}):
+            continue
+        DELIVERED_CONSENSUS_DECISIONS.setdefault(d.k, {})[d.server] = set(
+            tuple(x) for x in d.decided
+        )
+        log_record({"t": "decide", "server": d.server, "k": d.k, "decided": d.decided})
+        decisions += 1
+    if proposals:
+        notify(PROPOSALS_READY)
+    if decisions:
+        notify(DECISIONS_READY)
+    return len(delivered) + len(messages) + proposals + decisions
+
+
+async def anti_entropy(client: httpx.AsyncClient):
+    # gossip is best effort; periodically pull whatever a random peer has
+    # delivered and this node missed, e.g. while it was down or partitioned
+    logger.info("Anti-entropy task started")
+    peers = get_node_ids_excluding(NODE_ID)
+    while peers:
+        await asyncio.sleep(ANTI_ENTROPY_INTERVAL)
+        peer = random.choice(peers)
+        url = f"{get_node_address(peer)}/sync"
+        try:
+            more = True
+            while more:
+                resp = await client.post(
+                    url,
+                    json={
+                        "delivered": DELIVERED.to_json(),
+                        "delivered_cab": DELIVERED_CAB.to_json(),
+                        "limit": SYNC_BATCH_SIZE,
+                        "applied_k": APPLIED_CONSENSUS_K,
+                    },
+                    headers={"accept": wire.CONTENT_TYPE}
+                    if wire.WIRE_FORMAT == "binary"
+                    else {},
+                )
+                resp.raise_for_status()
+                if resp.headers.get("content-type") == wire.CONTENT_TYPE:
+                    data = wire.decode(resp.content)[1]
+                else:
+                    data = resp.json()
+                caught_up = apply_sync(data)
+                await make_durable()
+                if caught_up:
+                    logger.info("Pulled %s missed items from node %s", caught_up, peer)
+                more = data["more"] and caught_up > 0
+        except Exception as e:
+            # e.g. the peer is down or sent a malformed response; the next
+            # round tries again
+            logger.info("Anti-entropy with node %s failed: %s", peer, e)
+
+
+async def take_snapshots():
+    logger.info("Snapshot task started")
+    while WAL.failed is None:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        if await WAL.checkpoint(snapshot_state, STATE.storage.persist):
+            STATE.storage.finish_checkpoint()
+
+
+async def flush_storage():
+    # without a WAL nothing is recovered, but committed values still move to
+    # the storage engine's file so that they do not pile up in memory
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        STATE.storage.snapshot()
+        await asyncio.to_thread(STATE.storage.persist, 0)
+        STATE.storage.finish_checkpoint()
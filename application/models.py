@@ -1,9 +1,24 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
+
+from operation import Operation
 
 
 class InvokeRequestModel(BaseModel):
     op: list
     strong_op: bool
+    # wait for the result, up to timeout seconds (INVOKE_TIMEOUT if unset)
+    wait: bool = False
+    timeout: float | None = None
+
+    @field_validator("op")
+    @classmethod
+    def check_op(cls, op: list) -> list:
+        Operation.parse(op)
+        return op
+
+
+class InvokeBatchModel(BaseModel):
+    requests: list[InvokeRequestModel]
 
 
 class GossipModel(BaseModel):
@@ -11,7 +26,17 @@ class GossipModel(BaseModel):
     id: list[int]
     op: list
     strong_op: bool
-    causal_ctx: list
+    causal_ctx: dict
+
+    @field_validator("op")
+    @classmethod
+    def check_op(cls, op: list) -> list:
+        Operation.parse(op)
+        return op
+
+
+class GossipBatchModel(BaseModel):
+    requests: list[GossipModel]
 
 
 class GossipCABModel(BaseModel):
@@ -19,13 +44,32 @@ class GossipCABModel(BaseModel):
     q: str
 
 
+class GossipCABBatchModel(BaseModel):
+    messages: list[GossipCABModel]
+
+
+class SyncRequestModel(BaseModel):
+    # WatermarkSet.to_json() of the requester's DELIVERED and DELIVERED_CAB
+    delivered: dict
+    delivered_cab: dict
+    limit: int = 1000
+    # the requester's APPLIED_CONSENSUS_K; open instances above it are sent
+    applied_k: int = 0
+
+
 class ProposeCABModel(BaseModel):
     server: int
     unordered: list
     k: int
+    applied: int = 0
+    # when set, unordered/removed are a delta against the server's proposal
+    # for instance base
+    base: int | None = None
+    removed: list = []
 
 
 class DecideCABModel(BaseModel):
     server: int
     decided: list
     k: int
+    applied: int = 0
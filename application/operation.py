@@ -1,8 +1,62 @@
+OP_TYPES = ("GET", "PUT", "MGET", "MPUT")
+READ_TYPES = ("GET", "MGET")
+
+
+# GET/PUT take one key. MGET takes a list of keys and MPUT a list of
+# [key, value] pairs; either is a single log entry, so all its keys are read
+# or written atomically.
 class Operation:
     def __init__(self, op_type, key, value=None):
         self.op_type = op_type
         self.key = key
         self.value = value
+        self._check()
+
+    @classmethod
+    def parse(cls, op: list) -> "Operation":
+        # an op as clients and peers send it, e.g. ["PUT", key, value]
+        if not isinstance(op, (list, tuple)) or not 2 <= len(op) <= 3:
+            raise ValueError(f"Expected [type, key] or [type, key, value], got {op}")
+        return cls(*op)
+
+    def _check(self):
+        # a malformed op must be refused before it is logged or gossiped;
+        # once in the log every node has to execute it
+        if self.op_type not in OP_TYPES:
+            raise ValueError(f"Unknown op type {self.op_type}")
+        if self.op_type in ("GET", "PUT"):
+            _check_key(self.key)
+            return
+        if not isinstance(self.key, (list, tuple)) or not self.key:
+            raise ValueError(f"{self.op_type} takes a non-empty list, got {self.key}")
+        for item in self.key:
+            if self.op_type == "MPUT":
+                if not isinstance(item, (list, tuple)) or len(item) != 2:
+                    raise ValueError(f"MPUT takes [key, value] pairs, got {item}")
+                item = item[0]
+            _check_key(item)
+
+    def keys(self):
+        if self.op_type == "MGET":
+            return tuple(self.key)
+        if self.op_type == "MPUT":
+            return tuple(k for k, _ in self.key)
+        return (self.key,)
+
+    def writes(self):
+        if self.op_type == "PUT":
+            return {self.key: self.value}
+        if self.op_type == "MPUT":
+            return {k: v for k, v in self.key}
+        return {}
+
+    def is_read(self):
+        return self.op_type in READ_TYPES
 
     def __str__(self):
-        return f"Operation(type={self.op_type}, key={self.key}, value={self.value})"
\ No newline at end of file
+        return f"Operation(type={self.op_type}, key={self.key}, value={self.value})"
+
+
+def _check_key(key):
+    if isinstance(key, (list, tuple, dict)):
+        raise ValueError(f"Keys must be scalars, got {key}")
@@ -0,0 +1,97 @@
+from sortedcontainers import SortedKeyList
+
+from req import Request
+
+
+def order_key(req: Request):
+    return (req.ts, req.id)
+
+
+# COMMITTED (append-only, commit order) followed by TENTATIVE (sorted by
+# (ts, id)), with an id index over both parts.
+class OrderedLog:
+    def __init__(self):
+        self.committed = []
+        self.tentative = SortedKeyList(key=order_key)
+        self.index = {}
+        self.committed_pos = {}
+
+    def __len__(self):
+        return len(self.committed) + len(self.tentative)
+
+    def __contains__(self, req_id):
+        return req_id in self.index
+
+    def __iter__(self):
+        yield from self.committed
+        yield from self.tentative
+
+    def get(self, req_id):
+        return self.index.get(req_id)
+
+    def is_committed(self, req_id):
+        return req_id in self.committed_pos
+
+    def sort_key(self, req: Request):
+        # orders entries of both parts without computing their position
+        if req.id in self.committed_pos:
+            return (0, self.committed_pos[req.id])
+        return (1, req.ts, req.id)
+
+    def at(self, pos: int) -> Request:
+        if pos < len(self.committed):
+            return self.committed[pos]
+        return self.tentative[pos - len(self.committed)]
+
+    def position(self, req: Request) -> int:
+        if req.id in self.committed_pos:
+            return self.committed_pos[req.id]
+        return len(self.committed) + self.tentative.index(req)
+
+    def iter_from(self, pos: int):
+        n = len(self.committed)
+        if pos < n:
+            yield from self.committed[pos:]
+            pos = n
+        yield from self.tentative.islice(pos - n)
+
+    def tentative_in(self, req_ids):
+        if len(req_ids) < len(self.tentative):
+            found = [self.index[i] for i in req_ids if i in self.index]
+            return sorted(
+                (x for x in found if x.id not in self.committed_pos), key=order_key
+            )
+        return [x for x in self.tentative if x.id in req_ids]
+
+    def tentative_after(self, req: Request):
+        return self.tentative.irange_key(
+            min_key=order_key(req), inclusive=(False, True)
+        )
+
+    def insert(self, req: Request) -> int:
+        if req.id in self.index:
+            return self.position(self.index[req.id])
+        self.tentative.add(req)
+        self.index[req.id] = req
+        return self.position(req)
+
+    def commit(self, reqs: list[Request]) -> int:
+        # returns the first position whose entry changed, len(self) if none did
+        start = len(self.committed)
+        reqs = [x for x in reqs if x.id in self.index and x.id not in self.committed_pos]
+        unchanged = 0
+        for x in reqs:
+            if unchanged < len(self.tentative) and self.tentative[unchanged] is x:
+                unchanged += 1
+            else:
+                break
+        for x in reqs:
+            self.tentative.remove(x)
+            self.committed_pos[x.id] = len(self.committed)
+            self.committed.append(x)
+        if unchanged == len(reqs):
+            return len(self)
+        return start + unchanged
+
+    def __str__(self):
+        return f"OrderedLog(committed={len(self.committed)}, tentative={len(self.tentative)})"
@@ -0,0 +1,161 @@
+from collections import deque
+from itertools import islice
+
+from sortedcontainers import SortedKeyList
+
+from req import Request
+from state import State
+from ordered_log import OrderedLog
+
+
+# Keeps EXECUTED + TO_BE_EXECUTED equal to the log order. Instead of diffing the
+# whole history on every change, the log reports the earliest position it
+# reordered and only the suffix after that point is rolled back and re-queued.
+class ExecutionPlanner:
+    def __init__(self, log: OrderedLog):
+        self.log = log
+        self.executed = []
+        self.to_be_executed = deque()
+        self.to_be_rolledback = deque()
+        self.dirty = None
+        self.rolledback_count = 0
+
+    def insert(self, req: Request):
+        self.invalidate(self.log.insert(req), [req])
+
+    def commit(self, reqs: list[Request]):
+        self.invalidate(self.log.commit(reqs), reqs)
+
+    def invalidate(self, pos: int, reqs: list[Request]):
+        if self.dirty is None or pos < self.dirty:
+            self.dirty = pos
+
+    def plan(self):
+        if self.dirty is None:
+            return
+        pos, self.dirty = self.dirty, None
+        if pos < len(self.executed):
+            out_of_order = self.executed[pos:]
+            del self.executed[pos:]
+            # anything still waiting to be rolled back was executed after these
+            self.to_be_rolledback.extend(reversed(out_of_order))
+            self.rolledback_count += len(out_of_order)
+            self.to_be_executed.clear()
+        else:
+            keep = pos - len(self.executed)
+            while len(self.to_be_executed) > keep:
+                self.to_be_executed.pop()
+        self.to_be_executed.extend(self.log.iter_from(pos))
+
+    def next_rollback(self) -> Request | None:
+        if self.to_be_rolledback:
+            return self.to_be_rolledback.popleft()
+        return None
+
+    def next_execution(self) -> Request | None:
+        if not self.to_be_rolledback and self.to_be_executed:
+            return self.to_be_executed.popleft()
+        return None
+
+    def upcoming(self, n: int):
+        return islice(self.to_be_executed, n)
+
+    def mark_executed(self, req: Request):
+        self.executed.append(req)
+
+    def is_executed(self, req: Request) -> bool:
+        return self.log.position(req) < len(self.executed)
+
+    def __str__(self):
+        return (
+            f"{type(self).__name__}(executed={len(self.executed)}, "
+            f"to_be_executed={len(self.to_be_executed)}, "
+            f"to_be_rolledback={len(self.to_be_rolledback)}, "
+            f"rolledback_count={self.rolledback_count})"
+        )
+
+
+# Only rolls back executed ops that share a key with an op that was inserted
+# or moved, following the per-key chains kept by State. Ops on other keys
+# commute with the change and stay executed.
+class ConflictAwarePlanner(ExecutionPlanner):
+    def __init__(self, log: OrderedLog, state: State):
+        super().__init__(log)
+        self.state = state
+        self.executed = set()
+        self.to_be_executed = SortedKeyList(key=log.sort_key)
+        self.rolling_back = set()
+        self.changed = {}
+
+    def commit(self, reqs: list[Request]):
+        # sort keys change when ops enter the committed prefix
+        queued = [x for x in reqs if x in self.to_be_executed]
+        for x in queued:
+            self.to_be_executed.remove(x)
+        super().commit(reqs)
+        self.to_be_executed.update(queued)
+
+    def invalidate(self, pos: int, reqs: list[Request]):
+        if pos >= len(self.log):
+            return
+        for x in reqs:
+            self.changed[x.id] = x
+
+    def plan(self):
+        changed, self.changed = self.changed, {}
+        threshold = {}
+        for x in changed.values():
+            if x not in self.executed and x not in self.to_be_executed:
+                self.to_be_executed.add(x)
+            for key in x.op.keys():
+                k = (self.log.sort_key(x), 1)
+                if key not in threshold or k < threshold[key]:
+                    threshold[key] = k
+
+        out_of_order = []
+        work = list(threshold.items())
+        while work:
+            key, limit = work.pop()
+            chain = self.state.chains.get(key, [])
+            i = j = len(chain)
+            while i > 0:
+                x = chain[i - 1]
+                behind = (self.log.sort_key(x), 0) > limit
+                if x.id in self.rolling_back or behind:
+                    j = i - 1
+                elif x.id not in changed:
+                    break
+                i -= 1
+            for x in chain[j:]:
+                if x.id in self.rolling_back:
+                    continue
+                self.rolling_back.add(x.id)
+                out_of_order.append(x)
+                # undoing x also undoes whatever came after it on its other keys
+                for other in x.op.keys():
+                    if other != key:
+                        work.append((other, (self.log.sort_key(x), -1)))
+
+        out_of_order.sort(key=lambda x: self.state.applied[x.id], reverse=True)
+        self.to_be_rolledback.extend(out_of_order)
+        self.rolledback_count += len(out_of_order)
+        for x in out_of_order:
+            self.executed.discard(x)
+            self.to_be_executed.add(x)
+
+    def next_rollback(self) -> Request | None:
+        r = super().next_rollback()
+        if r is not None:
+            self.rolling_back.discard(r.id)
+        return r
+
+    def next_execution(self) -> Request | None:
+        if not self.to_be_rolledback and self.to_be_executed:
+            return self.to_be_executed.pop(0)
+        return None
+
+    def mark_executed(self, req: Request):
+        self.executed.add(req)
+
+    def is_executed(self, req: Request) -> bool:
+        return req in self.executed
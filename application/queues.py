@@ -0,0 +1,54 @@
+import os
+import asyncio
+from collections import deque
+
+from redis_helpers import get_async_redis_client, RedisQueues
+
+# "redis" keeps outbound messages in Redis so they survive a restart,
+# "memory" hands them straight to in-process senders
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "redis")
+
+
+# Same interface as RedisQueues for senders running in the same process:
+# messages are passed as objects, with no encoding and no extra hop.
+class MemoryQueues:
+    def __init__(self):
+        self.queues = {}
+        self.ready = asyncio.Event()
+
+    def lpush(self, queue: str, msg):
+        self.queues.setdefault(queue, deque()).appendleft(msg)
+        self.ready.set()
+
+    async def pop_batch(
+        self, queues: list[str], size: int, linger=0.0, timeout=1, raw=False
+    ):
+        # items are kept as objects, so raw changes nothing
+        if not any(self.queues.get(q) for q in queues):
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return {}
+        if linger > 0 and any(len(self.queues.get(q, ())) < size for q in queues):
+            await asyncio.sleep(linger)
+        batch = {}
+        for q in queues:
+            items = self.queues.get(q, deque())
+            batch[q] = [items.pop() for _ in range(min(size, len(items)))]
+        return batch
+
+    async def backlog(self, queues: list[str]) -> dict:
+        return {q: len(self.queues.get(q, ())) for q in queues}
+
+    async def aclose(self):
+        pass
+
+
+def get_queues(in_process: bool = False):
+    if QUEUE_BACKEND == "memory":
+        # nothing outside this process can read them
+        if not in_process:
+            raise RuntimeError("QUEUE_BACKEND=memory needs the senders in process, set IN_PROCESS=1")
+        return MemoryQueues()
+    return RedisQueues(get_async_redis_client())
@@ -1,15 +1,122 @@
 import os
+import json
+import asyncio
+import logging
 
 import redis
+import redis.asyncio as aioredis
 
-BUFFER_QUEUE = "buffer_queue"
-CAB_BUFFER_QUEUE = "msg_buffer_queue"
-CONSENSUS_PROPOSAL_QUEUE = "consensus_proposal_queue"
-CONSENSUS_DECISION_QUEUE = "consensus_decision_queue"
+import wire
+from sharding import queue_name
+
+logger = logging.getLogger("myapp")
+
+BUFFER_QUEUE = queue_name("buffer_queue")
+CAB_BUFFER_QUEUE = queue_name("msg_buffer_queue")
+CONSENSUS_PROPOSAL_QUEUE = queue_name("consensus_proposal_queue")
+CONSENSUS_DECISION_QUEUE = queue_name("consensus_decision_queue")
+
+QUEUE_KINDS = {
+    BUFFER_QUEUE: wire.REQUEST,
+    CAB_BUFFER_QUEUE: wire.MESSAGE,
+    CONSENSUS_PROPOSAL_QUEUE: wire.PROPOSAL,
+    CONSENSUS_DECISION_QUEUE: wire.DECISION,
+}
 
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", 16))
+
+
+def get_async_redis_client():
+    pool = aioredis.ConnectionPool(
+        host=REDIS_HOST, port=REDIS_PORT, db=0, max_connections=REDIS_POOL_SIZE
+    )
+    return aioredis.Redis(connection_pool=pool)
+
+
+# Outbound queues kept in Redis. Writes made while the event loop is busy are
+# collected and sent as one pipeline, so handlers never wait on a Redis
+# round-trip; readers block on BRPOP and drain whole batches.
+class RedisQueues:
+    def __init__(self, client: aioredis.Redis, retry_delay: float = 0.1):
+        self.client = client
+        self.retry_delay = retry_delay
+        self.pending = {}
+        self.flush_task = None
+
+    def lpush(self, queue: str, msg):
+        if wire.WIRE_FORMAT == "binary" and queue in QUEUE_KINDS:
+            value = wire.encode(QUEUE_KINDS[queue], msg)
+        else:
+            value = json.dumps(msg)
+        self.pending.setdefault(queue, []).append(value)
+        if self.flush_task is None:
+            self.flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        try:
+            while self.pending:
+                batch, self.pending = self.pending, {}
+                try:
+                    async with self.client.pipeline(transaction=False) as pipe:
+                        for queue, values in batch.items():
+                            pipe.lpush(queue, *values)
+                        await pipe.execute()
+                except redis.RedisError as e:
+                    logger.info("Redis write failed, retrying: %s", e)
+                    for queue, values in self.pending.items():
+                        batch.setdefault(queue, []).extend(values)
+                    self.pending = batch
+                    await asyncio.sleep(self.retry_delay)
+        finally:
+            self.flush_task = None
+
+    async def pop_batch(
+        self, queues: list[str], size: int, linger=0.0, timeout=1, raw=False
+    ):
+        # blocks until one of the queues has an item, then drains up to size
+        # items from every queue, waiting up to linger seconds for a batch to
+        # fill; returns {queue: [oldest, ...]}. With raw, binary frames are
+        # returned undecoded, to be spliced into batch frames.
+        item = await self.client.brpop(queues, timeout=timeout)
+        if item is None:
+            return {}
+        queue, value = item
+        batch = {q: [] for q in queues}
+        batch[queue.decode()].append(value)
+        await self._drain(batch, size)
+        if linger > 0 and any(len(values) < size for values in batch.values()):
+            await asyncio.sleep(linger)
+            await self._drain(batch, size)
+        return {q: [_decode(v, raw) for v in values] for q, values in batch.items()}
+
+    async def _drain(self, batch: dict, size: int):
+        rest = [q for q in batch if size > len(batch[q])]
+        async with self.client.pipeline(transaction=False) as pipe:
+            for q in rest:
+                pipe.rpop(q, size - len(batch[q]))
+            for q, values in zip(rest, await pipe.execute()):
+                batch[q].extend(values or [])
+
+    async def backlog(self, queues: list[str]) -> dict:
+        # items waiting in Redis plus those not yet written to it
+        async with self.client.pipeline(transaction=False) as pipe:
+            for q in queues:
+                pipe.llen(q)
+            lengths = await pipe.execute()
+        return {
+            q: n + len(self.pending.get(q, ())) for q, n in zip(queues, lengths)
+        }
+
+    async def aclose(self):
+        if self.flush_task is not None:
+            await self.flush_task
+        await self.client.aclose()
 
 
-def get_redis_client():
-    return redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+def _decode(value: bytes, raw=False):
+    # queues may still hold JSON written before a format change
+    if wire.is_binary(value):
+        return value if raw else wire.decode(value)[1]
+    return json.loads(value)
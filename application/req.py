@@ -1,16 +1,31 @@
-import time
-
+from hlc import LOGICAL_BITS, physical_now
+from causal import VersionVector
 from operation import Operation
 
 
 class Request:
 
     def __init__(self, id, op, strong_op, causal_ctx, ts=None):
-        self.ts = int(time.time()) if ts is None else ts
+        self.ts = physical_now() << LOGICAL_BITS if ts is None else ts
         self.id = tuple(id)
-        self.op = Operation(*op)
+        self.op = Operation.parse(op)
         self.strong_op = bool(strong_op)
-        self.causal_ctx = set(causal_ctx)
+        if isinstance(causal_ctx, VersionVector):
+            self.causal_ctx = causal_ctx
+        elif isinstance(causal_ctx, dict):
+            self.causal_ctx = VersionVector.from_json(causal_ctx)
+        else:
+            self.causal_ctx = VersionVector(causal_ctx)
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Request":
+        return cls(
+            id=data["id"],
+            op=data["op"],
+            strong_op=data["strong_op"],
+            causal_ctx=data["causal_ctx"],
+            ts=data["ts"],
+        )
 
     def is_greater_than(self, other: "Request"):
         if self.ts == other.ts:
@@ -32,7 +47,7 @@ class Request:
             "id": list(self.id),
             "op": [self.op.op_type, self.op.key, self.op.value],
             "strong_op": self.strong_op,
-            "causal_ctx": list(self.causal_ctx),
+            "causal_ctx": self.causal_ctx.to_json(),
         }
         return json_data
 
@@ -0,0 +1,196 @@
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import JSONResponse
+
+from custom_logger import setup_logging
+from models import InvokeBatchModel, InvokeRequestModel
+from server_helpers import get_http_client
+from sharding import split_op
+
+setup_logging()
+logger = logging.getLogger("myapp")
+
+# addresses of this node's shard processes, in shard order
+SHARD_URLS = os.getenv("SHARD_URLS", "localhost:9000").split(",")
+NO_SHARDS = len(SHARD_URLS)
+
+logger.info("NO_SHARDS: %s", NO_SHARDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.client = get_http_client()
+    yield
+    await app.state.client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+async def forward(shard: int, path: str, body: dict):
+    return await app.state.client.post(f"http://{SHARD_URLS[shard]}{path}", json=body)
+
+
+def passthrough(resp):
+    # keeps the shard's status and retry hints, e.g. when it sheds load
+    headers = {}
+    if "retry-after" in resp.headers:
+        headers["retry-after"] = resp.headers["retry-after"]
+    return Response(
+        content=resp.content,
+        status_code=resp.status_code,
+        headers=headers,
+        media_type=resp.headers.get("content-type"),
+    )
+
+
+def outcome(resp) -> dict:
+    # a shard's answer to one request or part, with its status
+    try:
+        body = resp.json()
+    except ValueError:
+        body = {"detail": resp.text}
+    return {"status": resp.status_code, **body}
+
+
+def multi_status(content: dict, failed: list):
+    # some shards applied their part and others refused theirs, so the call
+    # has no single status; the body says which parts went through
+    headers = {}
+    hints = [int(r.headers["retry-after"]) for r in failed if "retry-after" in r.headers]
+    if hints:
+        headers["retry-after"] = str(max(hints))
+    return JSONResponse(status_code=207, content=content, headers=headers)
+
+
+def check_split(request: InvokeRequestModel):
+    # only weak ops may be split, since a strong op must commit atomically
+    # in one replication group
+    if request.strong_op:
+        raise HTTPException(
+            status_code=400, detail="Strong multi-key ops must stay within one shard"
+        )
+
+
+async def invoke_parts(request: InvokeRequestModel, parts: dict):
+    # an op whose keys live on several shards; returns the combined response
+    # and the shard responses that failed
+    shards = list(parts)
+    resps = await asyncio.gather(
+        *[
+            forward(shard, "/invoke", {**request.model_dump(), "op": parts[shard]})
+            for shard in shards
+        ]
+    )
+    failed = [resp for resp in resps if resp.status_code != 200]
+    response = {
+        "parts": [{"shard": shard, **outcome(resp)} for shard, resp in zip(shards, resps)]
+    }
+    if request.op[0] == "MGET" and not failed:
+        # reassemble the values in the order the keys were asked for
+        values = {}
+        for shard, part in zip(shards, response["parts"]):
+            for key, value in zip(parts[shard][1], part["result"]):
+                values[key] = value
+        response["result"] = [values[key] for key in request.op[1]]
+    return response, failed
+
+
+def split_status(response: dict, failed: list) -> int:
+    if not failed:
+        return 200
+    if len(failed) == len(response["parts"]):
+        return failed[0].status_code
+    return 207
+
+
+@app.post("/invoke")
+async def invoke(request: InvokeRequestModel):
+    parts = split_op(request.op, NO_SHARDS)
+    if len(parts) > 1:
+        check_split(request)
+        response, failed = await invoke_parts(request, parts)
+        status = split_status(response, failed)
+        if status == 207:
+            return multi_status(response, failed)
+        if status != 200:
+            # no part went through
+            return passthrough(failed[0])
+        return response
+    (shard,) = parts
+    resp = await forward(shard, "/invoke", request.model_dump())
+    if resp.status_code != 200:
+        return passthrough(resp)
+    return {"shard": shard, **resp.json()}
+
+
+@app.post("/invoke-batch")
+async def invoke_batch(request: InvokeBatchModel):
+    # single-shard requests go out as one batch per shard. Each response
+    # carries its own status, since shards admit or refuse their batches
+    # independently.
+    per_shard = {}
+    split = []
+    responses = [None] * len(request.requests)
+    for i, x in enumerate(request.requests):
+        parts = split_op(x.op, NO_SHARDS)
+        if len(parts) == 1:
+            (shard,) = parts
+            per_shard.setdefault(shard, []).append(i)
+            continue
+        try:
+            check_split(x)
+        except HTTPException as e:
+            responses[i] = {"status": e.status_code, "detail": e.detail}
+            continue
+        split.append((i, parts))
+    shards = list(per_shard)
+    batch_resps, split_resps = await asyncio.gather(
+        asyncio.gather(
+            *[
+                forward(
+                    shard,
+                    "/invoke-batch",
+                    {"requests": [request.requests[i].model_dump() for i in idx]},
+                )
+                for shard, idx in per_shard.items()
+            ]
+        ),
+        asyncio.gather(*[invoke_parts(request.requests[i], parts) for i, parts in split]),
+    )
+    failed = []
+    for shard, resp in zip(shards, batch_resps):
+        if resp.status_code != 200:
+            # the shard refused its whole batch
+            failed.append(resp)
+            for i in per_shard[shard]:
+                responses[i] = {"shard": shard, **outcome(resp)}
+            continue
+        for i, r in zip(per_shard[shard], resp.json()["responses"]):
+            responses[i] = {"shard": shard, "status": 200, **r}
+    for (i, _), (response, part_failed) in zip(split, split_resps):
+        failed.extend(part_failed)
+        responses[i] = {"status": split_status(response, part_failed), **response}
+    if failed and all(r["status"] not in (200, 207) for r in responses):
+        # nothing was applied
+        return passthrough(failed[0])
+    if any(r["status"] != 200 for r in responses):
+        return multi_status({"responses": responses}, failed)
+    return {"responses": responses}
+
+
+@app.get("/metrics")
+async def metrics():
+    resps = await asyncio.gather(
+        *[app.state.client.get(f"http://{url}/metrics") for url in SHARD_URLS]
+    )
+    shards = [resp.json() for resp in resps]
+    totals = {}
+    for m in shards:
+        for name, value in m.items():
+            totals[name] = totals.get(name, 0) + value
+    return {**totals, "shards": shards}
@@ -0,0 +1,80 @@
+import os
+import sys
+import signal
+import logging
+import subprocess
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+
+logger = logging.getLogger()
+
+# Starts a sharded node: one replication group per shard, each in its own
+# process, plus the router on PORT. Shard s of every node listens on
+# SHARD_BASE_PORT + s of that node's host, so the shard processes of the same
+# shard on different nodes form one group.
+NO_SHARDS = int(os.getenv("NO_SHARDS", "1"))
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", "9000"))
+PORT = int(os.getenv("PORT", "8888"))
+NODE_URLS = os.getenv("NODE_URLS", "0").split(",")
+IN_PROCESS = os.getenv("IN_PROCESS", "0") == "1"
+WAL_DIR = os.getenv("WAL_DIR")
+STORAGE_PATH = os.getenv("STORAGE_PATH")
+
+
+def shard_env(shard: int):
+    env = dict(os.environ)
+    env["SHARD_ID"] = str(shard)
+    env["NODE_URLS"] = ",".join(
+        f"{url.rsplit(':', 1)[0]}:{SHARD_BASE_PORT + shard}" for url in NODE_URLS
+    )
+    if WAL_DIR:
+        env["WAL_DIR"] = os.path.join(WAL_DIR, f"shard-{shard}")
+    # without STORAGE_PATH the sqlite file sits in the shard's WAL_DIR
+    if STORAGE_PATH or not WAL_DIR:
+        root, ext = os.path.splitext(STORAGE_PATH or "state.sqlite")
+        env["STORAGE_PATH"] = f"{root}-shard-{shard}{ext}"
+    return env
+
+
+def main():
+    procs = []
+    for shard in range(NO_SHARDS):
+        env = shard_env(shard)
+        port = str(SHARD_BASE_PORT + shard)
+        procs.append(
+            subprocess.Popen(
+                ["uvicorn", "main:app", "--host", "0.0.0.0", "--port", port], env=env
+            )
+        )
+        if not IN_PROCESS:
+            procs.append(subprocess.Popen([sys.executable, "gossiping.py"], env=env))
+            procs.append(subprocess.Popen([sys.executable, "consensus.py"], env=env))
+    env = dict(os.environ)
+    env["SHARD_URLS"] = ",".join(
+        f"localhost:{SHARD_BASE_PORT + shard}" for shard in range(NO_SHARDS)
+    )
+    procs.append(
+        subprocess.Popen(
+            ["uvicorn", "router:app", "--host", "0.0.0.0", "--port", str(PORT)], env=env
+        )
+    )
+    logger.info("Started %s shards behind the router on port %s", NO_SHARDS, PORT)
+
+    def stop(signum, frame):
+        for p in procs:
+            p.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    # if any process exits the node is incomplete, so take the rest down too
+    os.wait()
+    stop(None, None)
+    for p in procs:
+        p.wait()
+
+
+if __name__ == "__main__":
+    main()
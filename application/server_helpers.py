@@ -1,12 +1,22 @@
 import os
-import random
 import logging
 
+import httpx
+
+import wire
+
 logger = logging.getLogger()
 
 NODE_URLS = os.getenv("NODE_URLS", "0").split(",")
 NO_NODES = len(NODE_URLS)
-NODE_ID = int(os.getenv("NODE_ID"))
+NODE_ID = int(os.getenv("NODE_ID", "0"))
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "5"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+
+
+# peers that do not accept binary bodies (415) and are sent JSON from then on
+JSON_ONLY_PEERS = set()
 
 
 logger.info("NO_NODES: %s", NO_NODES)
@@ -21,6 +31,28 @@ def get_node_ids_excluding(exclude):
     return [i for i in range(NO_NODES) if i != exclude]
 
 
-def random_sample_excluding(k, exclude):
-    population = get_node_ids_excluding(exclude)
-    return random.sample(population, k)
+def get_http_client(timeout=HTTP_TIMEOUT):
+    return httpx.AsyncClient(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+        ),
+    )
+
+
+async def post_message(client, node_index, path, data, **kwargs):
+    url = f"{get_node_address(node_index)}{path}"
+    if wire.WIRE_FORMAT == "binary" and node_index not in JSON_ONLY_PEERS:
+        resp = await client.post(
+            url,
+            content=wire.encode(wire.PATH_KINDS[path], data),
+            headers={"content-type": wire.CONTENT_TYPE},
+            **kwargs,
+        )
+        # a 422 is about this message, not the format
+        if resp.status_code != 415:
+            return resp
+        logger.info("Node %s does not accept binary messages, using JSON", node_index)
+        JSON_ONLY_PEERS.add(node_index)
+    return await client.post(url, json=wire.plain(data), **kwargs)
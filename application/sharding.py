@@ -0,0 +1,34 @@
+import os
+import json
+import zlib
+
+# A sharded node runs one replication group per shard, each in its own
+# process with its own log, causal context, State and consensus sequence.
+# SHARD_ID is set for those processes; unsharded nodes leave it unset.
+SHARD_ID = os.getenv("SHARD_ID")
+
+
+def shard_for_key(key, no_shards: int) -> int:
+    # must agree across processes and nodes, so no hash()
+    return zlib.crc32(json.dumps(key).encode()) % no_shards
+
+
+def split_op(op: list, no_shards: int) -> dict:
+    # shard -> the part of op that touches keys of that shard
+    op_type = op[0]
+    if op_type == "MGET":
+        parts = {}
+        for key in op[1]:
+            parts.setdefault(shard_for_key(key, no_shards), []).append(key)
+        return {shard: ["MGET", keys] for shard, keys in parts.items()}
+    if op_type == "MPUT":
+        parts = {}
+        for key, value in op[1]:
+            parts.setdefault(shard_for_key(key, no_shards), []).append([key, value])
+        return {shard: ["MPUT", pairs] for shard, pairs in parts.items()}
+    return {shard_for_key(op[1], no_shards): op}
+
+
+def queue_name(name: str) -> str:
+    # shards of one node may share a Redis
+    return name if SHARD_ID is None else f"{name}_{SHARD_ID}"
@@ -1,25 +1,101 @@
 from req import Request
+from operation import Operation
+from storage import MISSING, MemoryStorage
 
 
 class State:
-    def __init__(self):
-        self.db = {}
-        self.undo_log = {}
+    def __init__(self, storage=None):
+        # current and committed values, see storage.py
+        self.storage = storage if storage is not None else MemoryStorage()
+        # key -> requests that read or wrote it since the committed prefix, in
+        # the order they were applied. The writes in a chain are the versions
+        # of the key above its committed value. Chains only cover the
+        # uncommitted window, so they stay in memory.
+        self.chains = {}
+        self.applied = {}
+        self.seq = 0
 
     def execute(self, req: Request):
-        if req.op.op_type == "GET":
-            return self.db.get(req.op.key, None)
-        elif req.op.op_type == "PUT":
-            prev_value = self.db.get(req.op.key, None)
-            self.undo_log[req.id] = prev_value
-            self.db[req.op.key] = req.op.value
-            return "OK"
+        self.seq += 1
+        self.applied[req.id] = self.seq
+        for key in req.op.keys():
+            self.chains.setdefault(key, []).append(req)
+        if req.op.is_read():
+            return self.read_op(req.op)
+        for key, value in req.op.writes().items():
+            self.storage.put(key, value)
+        return "OK"
 
     def rollback(self, req: Request):
-        if req.id in self.undo_log:
-            prev_value = self.undo_log[req.id]
-            self.db[req.op.key] = prev_value
-            self.undo_log[req.id] = None
+        if self.applied.pop(req.id, None) is None:
+            return
+        for key in req.op.keys():
+            chain = self.chains.get(key, [])
+            for i in range(len(chain) - 1, -1, -1):
+                if chain[i] == req:
+                    del chain[i]
+                    break
+            if key in req.op.writes():
+                self._restore(key)
+            if not chain:
+                self.chains.pop(key, None)
+
+    def commit(self, req: Request):
+        # req is executed and can no longer be rolled back, so it and every
+        # version before it on its keys fold into the committed value
+        if req.id not in self.applied:
+            return
+        for key in req.op.keys():
+            chain = self.chains.get(key, [])
+            for i, x in enumerate(chain):
+                if x == req:
+                    break
+            else:
+                continue
+            for x in chain[: i + 1]:
+                writes = x.op.writes()
+                if key in writes:
+                    self.storage.put_committed(key, writes[key])
+            del chain[: i + 1]
+            if not chain:
+                # every version of the key is folded in
+                self.chains.pop(key, None)
+                self.storage.reset(key)
+        self.applied.pop(req.id, None)
+
+    def restore(self, items):
+        # (key, value) pairs of a fully executed committed prefix, e.g. from
+        # a snapshot
+        self.storage.restore(items)
+
+    async def prefetch(self, ops):
+        # loads what the given ops will read, so that executing them does
+        # not wait for the disk
+        keys = [key for op in ops if op.is_read() for key in op.keys()]
+        if keys:
+            await self.storage.prefetch(keys)
+
+    def read(self, key):
+        value = self.storage.get(key)
+        return None if value is MISSING else value
+
+    def read_op(self, op: Operation):
+        if op.op_type == "MGET":
+            return [self.read(key) for key in op.keys()]
+        return self.read(op.key)
+
+    def read_committed(self, key):
+        value = self.storage.get_committed(key)
+        return None if value is MISSING else value
+
+    def _restore(self, key):
+        for x in reversed(self.chains.get(key, [])):
+            writes = x.op.writes()
+            if key in writes:
+                self.storage.put(key, writes[key])
+                return
+        self.storage.reset(key)
 
     def __str__(self):
-        return f"State(db={self.db}, undo_log={self.undo_log})"
+        versions = sum(len(c) for c in self.chains.values())
+        return f"State(storage={self.storage}, versions={versions})"
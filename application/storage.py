@@ -0,0 +1,244 @@
+import os
+import json
+import asyncio
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# "memory" keeps every key in a dict, "sqlite" keeps the committed values in
+# a file and only the most recently used ones in memory
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "memory")
+STORAGE_PATH = os.getenv("STORAGE_PATH") or os.path.join(
+    os.getenv("WAL_DIR") or ".", "state.sqlite"
+)
+STORAGE_CACHE_SIZE = int(os.getenv("STORAGE_CACHE_SIZE", "100000"))
+
+# stands in for a key that has no value, since None is a value
+MISSING = object()
+
+
+# Each key has its value as of the committed prefix and, while tentative ops
+# have written it, a current value on top. The committed value is the undo
+# record of the key: once every tentative write on it is rolled back or
+# committed, reset() drops the current value and reads see the committed one.
+# Current values only cover the uncommitted window, so they stay in memory.
+class MemoryStorage:
+    def __init__(self):
+        self.committed = {}
+        self.current = {}
+
+    def get(self, key):
+        if key in self.current:
+            return self.current[key]
+        return self.committed.get(key, MISSING)
+
+    def get_committed(self, key):
+        return self.committed.get(key, MISSING)
+
+    def put(self, key, value):
+        self.current[key] = value
+
+    def reset(self, key):
+        self.current.pop(key, None)
+
+    def put_committed(self, key, value):
+        self.committed[key] = value
+
+    async def prefetch(self, keys):
+        pass
+
+    def snapshot(self):
+        # the committed values, embedded in the snapshot
+        return [[k, v] for k, v in self.committed.items()]
+
+    def persist(self, segment: int):
+        pass
+
+    def finish_checkpoint(self):
+        pass
+
+    def persisted_segment(self):
+        return None
+
+    def restore(self, items):
+        self.committed = dict(items)
+        self.current = {}
+
+    def close(self):
+        pass
+
+    def __str__(self):
+        return f"MemoryStorage(keys={len(self.committed)}, current={len(self.current)})"
+
+
+# Committed values live in a sqlite file that is only written at checkpoints:
+# the values committed since the last one are kept in memory and written in
+# one transaction together with the WAL segment the checkpoint starts, so the
+# file always matches a snapshot and restart replays the log on top of it.
+# Clean values are cached in LRU order. The file is read on its own thread;
+# prefetch() loads keys before they are read, anything else not in memory is
+# read synchronously.
+class SqliteStorage:
+    def __init__(self, path: str, cache_size: int):
+        self.path = path
+        self.cache_size = max(1, cache_size)
+        self.current = {}
+        # committed values not in the file yet, and those being written by
+        # the running checkpoint
+        self.dirty = {}
+        self.flushing = {}
+        self.cache = OrderedDict()
+        # bumped when a checkpoint lands, so reads started before it are
+        # not cached
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # written by checkpoints and restore, never from the event loop
+        self.writer = sqlite3.connect(path, check_same_thread=False)
+        self.writer.execute("PRAGMA journal_mode=WAL")
+        self.writer.execute("PRAGMA synchronous=FULL")
+        self.writer.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self.writer.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)"
+        )
+        self.writer.commit()
+        found = self.writer.execute(
+            "SELECT value FROM meta WHERE name = 'segment'"
+        ).fetchone()
+        self.segment = found[0] if found is not None else 0
+        self.io = ThreadPoolExecutor(max_workers=1)
+        self.reader = self.io.submit(sqlite3.connect, path).result()
+
+    def get(self, key):
+        if key in self.current:
+            return self.current[key]
+        return self.get_committed(key)
+
+    def get_committed(self, key):
+        for values in (self.dirty, self.flushing):
+            if key in values:
+                return values[key]
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        value = self.io.submit(self._read, [key]).result()[key]
+        self._cache(key, value)
+        return value
+
+    def put(self, key, value):
+        self.current[key] = value
+
+    def reset(self, key):
+        self.current.pop(key, None)
+
+    def put_committed(self, key, value):
+        self.dirty[key] = value
+
+    async def prefetch(self, keys):
+        missing = [
+            k
+            for k in dict.fromkeys(keys)
+            if k not in self.current
+            and k not in self.dirty
+            and k not in self.flushing
+            and k not in self.cache
+        ]
+        if not missing:
+            return
+        self.misses += len(missing)
+        generation = self.generation
+        loop = asyncio.get_running_loop()
+        values = await loop.run_in_executor(self.io, self._read, missing)
+        if generation != self.generation:
+            return
+        for key, value in values.items():
+            if key not in self.cache:
+                self._cache(key, value)
+
+    def snapshot(self):
+        # nothing is embedded; the values committed since the last
+        # checkpoint are written to the file by persist()
+        self.flushing.update(self.dirty)
+        self.dirty = {}
+        return None
+
+    def persist(self, segment: int):
+        # runs off the event loop, which leaves flushing alone meanwhile
+        rows = [(json.dumps(k), json.dumps(v)) for k, v in self.flushing.items()]
+        with self.writer:
+            self.writer.executemany("INSERT OR REPLACE INTO kv VALUES (?, ?)", rows)
+            self.writer.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('segment', ?)", (segment,)
+            )
+        self.segment = segment
+
+    def finish_checkpoint(self):
+        for key, value in self.flushing.items():
+            if key in self.cache:
+                self.cache[key] = value
+        self.flushing = {}
+        self.generation += 1
+
+    def persisted_segment(self):
+        return self.segment
+
+    def restore(self, items):
+        # replaces the committed values, e.g. when there is no WAL to
+        # recover them from
+        with self.writer:
+            self.writer.execute("DELETE FROM kv")
+            self.writer.executemany(
+                "INSERT INTO kv VALUES (?, ?)",
+                ((json.dumps(k), json.dumps(v)) for k, v in items),
+            )
+            self.writer.execute("INSERT OR REPLACE INTO meta VALUES ('segment', 0)")
+        self.segment = 0
+        self.current = {}
+        self.dirty = {}
+        self.flushing = {}
+        self.cache.clear()
+        self.generation += 1
+
+    def close(self):
+        # committed values after the last checkpoint are recovered from the WAL
+        self.io.submit(self.reader.close).result()
+        self.io.shutdown()
+        self.writer.close()
+
+    def _read(self, keys: list) -> dict:
+        values = dict.fromkeys(keys, MISSING)
+        encoded = {json.dumps(k): k for k in keys}
+        names = list(encoded)
+        for i in range(0, len(names), 500):
+            chunk = names[i : i + 500]
+            cur = self.reader.execute(
+                f"SELECT key, value FROM kv WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for name, value in cur:
+                values[encoded[name]] = json.loads(value)
+        return values
+
+    def _cache(self, key, value):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def __str__(self):
+        return (
+            f"SqliteStorage(path={self.path}, segment={self.segment}, "
+            f"current={len(self.current)}, dirty={len(self.dirty)}, "
+            f"cached={len(self.cache)}, hits={self.hits}, misses={self.misses})"
+        )
+
+
+def get_storage():
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteStorage(STORAGE_PATH, STORAGE_CACHE_SIZE)
+    return MemoryStorage()
@@ -0,0 +1,182 @@
+import os
+import json
+import asyncio
+import logging
+
+logger = logging.getLogger("myapp")
+
+
+class WALError(RuntimeError):
+    pass
+
+
+# Append-only log of the inputs that changed replica state, plus periodic
+# snapshots. Records appended while a write is in flight are written together
+# and share one fsync (group commit). Each snapshot names the log segment that
+# continues it, so restart loads the snapshot and replays only that segment.
+# After a failed write or fsync it is unknown what reached the disk, so the
+# log stops and every later sync() raises WALError.
+class WriteAheadLog:
+    def __init__(self, directory: str, group_commit_delay: float = 0.0):
+        self.directory = directory
+        self.group_commit_delay = group_commit_delay
+        self.segment = 0
+        self.file = None
+        self.pending = []
+        self.appended = 0
+        self.flushed = 0
+        self.flush_task = None
+        self.failed = None
+        self.lock = asyncio.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _segment_path(self, segment: int):
+        return os.path.join(self.directory, f"wal-{segment}.log")
+
+    def _snapshot_path(self):
+        return os.path.join(self.directory, "snapshot.json")
+
+    def load(self, persisted_segment: int | None = None):
+        # returns (snapshot or None, records logged after it) and opens the
+        # segment for appending. persisted_segment is the checkpoint an
+        # external store last committed, see checkpoint().
+        snapshot = None
+        if os.path.exists(self._snapshot_path()):
+            with open(self._snapshot_path()) as f:
+                snapshot = json.load(f)
+        if persisted_segment and (
+            snapshot is None or snapshot["segment"] < persisted_segment
+        ):
+            # the store committed a checkpoint whose snapshot was not yet
+            # renamed into place
+            with open(self._snapshot_path() + ".tmp") as f:
+                snapshot = json.load(f)
+        if snapshot is not None:
+            self.segment = snapshot["segment"]
+        records = []
+        path = self._segment_path(self.segment)
+        if os.path.exists(path):
+            # end of the last complete record
+            end = 0
+            with open(path, "r+b") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("no newline")
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # torn write of the last group before a crash
+                        logger.info("Dropping incomplete WAL record in %s", path)
+                        break
+                    end += len(line)
+                # appending after the torn bytes would merge the next record
+                # into them
+                if f.seek(0, os.SEEK_END) != end:
+                    f.truncate(end)
+                    f.flush()
+                    os.fsync(f.fileno())
+        self.file = open(path, "a")
+        self._sync_directory()
+        self._remove_old_segments()
+        return snapshot, records
+
+    def append(self, record: dict):
+        if self.failed is not None:
+            return
+        self.pending.append(json.dumps(record, separators=(",", ":")))
+        self.appended += 1
+
+    async def sync(self):
+        # returns once every record appended so far is on disk
+        target = self.appended
+        while self.flushed < target:
+            if self.failed is not None:
+                raise WALError("write-ahead log failed") from self.failed
+            if self.flush_task is None:
+                self.flush_task = asyncio.create_task(self._flush())
+            await asyncio.shield(self.flush_task)
+
+    async def _flush(self):
+        try:
+            if self.group_commit_delay > 0:
+                await asyncio.sleep(self.group_commit_delay)
+            async with self.lock:
+                lines, self.pending = self.pending, []
+                count = self.appended
+                if lines:
+                    await asyncio.to_thread(self._write, lines)
+                self.flushed = max(self.flushed, count)
+        except OSError as e:
+            self._fail(e)
+        finally:
+            self.flush_task = None
+
+    def _write(self, lines: list[str]):
+        self.file.write("\n".join(lines) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    async def checkpoint(self, take_snapshot, persist=None) -> bool:
+        # take_snapshot() captures the state covering every record appended so
+        # far, or returns None if now is not a good time; later records go to
+        # a new segment. persist(segment), if given, commits state kept outside
+        # the snapshot; it runs off the event loop once the snapshot is on
+        # disk and before it replaces the previous one.
+        async with self.lock:
+            snapshot = take_snapshot()
+            if snapshot is None:
+                return False
+            lines, self.pending = self.pending, []
+            count = self.appended
+            snapshot["segment"] = self.segment + 1
+            try:
+                await asyncio.to_thread(self._rotate, lines, snapshot, persist)
+            except Exception as e:
+                self._fail(e)
+                return False
+            self.flushed = max(self.flushed, count)
+        logger.info("Wrote snapshot, WAL continues in segment %s", self.segment)
+        return True
+
+    def _fail(self, error: Exception):
+        # the lines taken for the write are gone; writing them again could
+        # land after a torn record, which load() stops at
+        logger.error("Write-ahead log failed, no longer acknowledging writes: %s", error)
+        self.failed = error
+        self.pending = []
+
+    def _rotate(self, lines: list[str], snapshot: dict, persist=None):
+        if lines:
+            self._write(lines)
+        tmp = self._snapshot_path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        if persist is not None:
+            persist(snapshot["segment"])
+        new_file = open(self._segment_path(snapshot["segment"]), "a")
+        os.replace(tmp, self._snapshot_path())
+        # both the new segment and the rename are directory entries
+        self._sync_directory()
+        self.file.close()
+        self.file = new_file
+        self.segment = snapshot["segment"]
+        self._remove_old_segments()
+
+    def _sync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _remove_old_segments(self):
+        for name in os.listdir(self.directory):
+            if name.startswith("wal-") and name.endswith(".log"):
+                if int(name[4:-4]) < self.segment:
+                    os.remove(os.path.join(self.directory, name))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
@@ -0,0 +1,332 @@
+import os
+import struct
+
+# Binary encoding of the messages nodes exchange over HTTP and keep in the
+# outbound queues. A frame is MAGIC, a kind byte and the payload. Integers are
+# varints, ids are two varints, version vectors are packed (node, max) pairs
+# plus (node, start, end) gap ranges, strings and lists are length-prefixed.
+# Decoding yields the same dicts as the JSON form, so either format can be
+# used on any hop. A batch is the count followed by its items without their
+# headers, so frames taken from the queues are spliced in as they are.
+
+# "binary" sends the binary format to peers that accept it, "json" never does
+WIRE_FORMAT = os.getenv("WIRE_FORMAT", "binary")
+CONTENT_TYPE = "application/x-creek"
+MAGIC = 0xC1
+
+REQUEST = 1
+MESSAGE = 2
+PROPOSAL = 3
+DECISION = 4
+REQUEST_BATCH = 5
+MESSAGE_BATCH = 6
+SYNC_RESPONSE = 7
+
+PATH_KINDS = {
+    "/gossip": REQUEST,
+    "/gossip-cab": MESSAGE,
+    "/propose-cab": PROPOSAL,
+    "/decide-cab": DECISION,
+    "/gossip-batch": REQUEST_BATCH,
+    "/gossip-cab-batch": MESSAGE_BATCH,
+}
+
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _LIST, _DICT = range(8)
+_DOUBLE = struct.Struct("<d")
+
+
+class WireError(ValueError):
+    pass
+
+
+class _Writer:
+    def __init__(self):
+        self.buf = bytearray()
+
+    def uint(self, n: int):
+        if n < 0:
+            raise WireError(f"negative varint {n}")
+        while n > 0x7F:
+            self.buf.append((n & 0x7F) | 0x80)
+            n >>= 7
+        self.buf.append(n)
+
+    def int(self, n: int):
+        # zigzag so small negative numbers stay short
+        self.uint(n << 1 if n >= 0 else ((-n) << 1) - 1)
+
+    def str(self, s: str):
+        data = s.encode()
+        self.uint(len(data))
+        self.buf += data
+
+    def id(self, req_id):
+        node, event = req_id
+        self.uint(node)
+        self.uint(event)
+
+    def ids(self, req_ids):
+        req_ids = list(req_ids)
+        self.uint(len(req_ids))
+        for req_id in req_ids:
+            self.id(req_id)
+
+    def value(self, v):
+        if v is None:
+            self.buf.append(_NONE)
+        elif v is True:
+            self.buf.append(_TRUE)
+        elif v is False:
+            self.buf.append(_FALSE)
+        elif isinstance(v, int):
+            self.buf.append(_INT)
+            self.int(v)
+        elif isinstance(v, float):
+            self.buf.append(_FLOAT)
+            self.buf += _DOUBLE.pack(v)
+        elif isinstance(v, str):
+            self.buf.append(_STR)
+            self.str(v)
+        elif isinstance(v, (list, tuple)):
+            self.buf.append(_LIST)
+            self.uint(len(v))
+            for x in v:
+                self.value(x)
+        elif isinstance(v, dict):
+            self.buf.append(_DICT)
+            self.uint(len(v))
+            for k, x in v.items():
+                self.str(k)
+                self.value(x)
+        else:
+            raise WireError(f"cannot encode {type(v).__name__}")
+
+    def causal_ctx(self, ctx: dict):
+        vv = ctx.get("vv", [])
+        self.uint(len(vv))
+        for node, top in vv:
+            self.uint(node)
+            self.uint(top)
+        gaps = ctx.get("gaps", [])
+        self.uint(len(gaps))
+        for node, start, end in gaps:
+            self.uint(node)
+            self.uint(start)
+            self.uint(end)
+
+    def request(self, r: dict):
+        self.uint(r["ts"])
+        self.id(r["id"])
+        self.value(r["op"])
+        self.buf.append(1 if r["strong_op"] else 0)
+        self.causal_ctx(r["causal_ctx"])
+
+    def message(self, msg: dict):
+        self.id(msg["m"])
+        self.str(msg["q"])
+
+    def proposal(self, data: dict):
+        self.uint(data["server"])
+        self.uint(data["k"])
+        self.uint(data.get("applied", 0))
+        base = data.get("base")
+        self.uint(0 if base is None else base + 1)
+        self.ids(data["unordered"])
+        self.ids(data.get("removed", []))
+
+    def decision(self, data: dict):
+        self.uint(data["server"])
+        self.uint(data["k"])
+        self.uint(data.get("applied", 0))
+        self.ids(data["decided"])
+
+    def frame(self, kind: int, frame: bytes):
+        if frame[:2] != bytes((MAGIC, kind)):
+            raise WireError(f"not a frame of kind {kind}")
+        self.buf += memoryview(frame)[2:]
+
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def byte(self) -> int:
+        if self.pos >= len(self.data):
+            raise WireError("truncated frame")
+        b = self.data[self.pos]
+        self.pos += 1
+        return b
+
+    def uint(self) -> int:
+        n = shift = 0
+        while True:
+            b = self.byte()
+            n |= (b & 0x7F) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+
+    def int(self) -> int:
+        n = self.uint()
+        return (n >> 1) ^ -(n & 1)
+
+    def raw(self, size: int) -> bytes:
+        if self.pos + size > len(self.data):
+            raise WireError("truncated frame")
+        data = bytes(self.data[self.pos : self.pos + size])
+        self.pos += size
+        return data
+
+    def str(self) -> str:
+        try:
+            return self.raw(self.uint()).decode()
+        except UnicodeDecodeError as e:
+            raise WireError(f"invalid string: {e}") from None
+
+    def id(self) -> list:
+        return [self.uint(), self.uint()]
+
+    def ids(self) -> list:
+        return [self.id() for _ in range(self.uint())]
+
+    def value(self):
+        tag = self.byte()
+        if tag == _NONE:
+            return None
+        if tag == _TRUE:
+            return True
+        if tag == _FALSE:
+            return False
+        if tag == _INT:
+            return self.int()
+        if tag == _FLOAT:
+            return _DOUBLE.unpack(self.raw(_DOUBLE.size))[0]
+        if tag == _STR:
+            return self.str()
+        if tag == _LIST:
+            return [self.value() for _ in range(self.uint())]
+        if tag == _DICT:
+            return {self.str(): self.value() for _ in range(self.uint())}
+        raise WireError(f"unknown value tag {tag}")
+
+    def causal_ctx(self) -> dict:
+        vv = [[self.uint(), self.uint()] for _ in range(self.uint())]
+        gaps = [[self.uint(), self.uint(), self.uint()] for _ in range(self.uint())]
+        return {"vv": vv, "gaps": gaps}
+
+    def request(self) -> dict:
+        return {
+            "ts": self.uint(),
+            "id": self.id(),
+            "op": self.value(),
+            "strong_op": self.byte() == 1,
+            "causal_ctx": self.causal_ctx(),
+        }
+
+    def message(self) -> dict:
+        return {"m": self.id(), "q": self.str()}
+
+    def proposal(self) -> dict:
+        data = {"server": self.uint(), "k": self.uint(), "applied": self.uint()}
+        base = self.uint()
+        data["base"] = None if base == 0 else base - 1
+        data["unordered"] = self.ids()
+        data["removed"] = self.ids()
+        return data
+
+    def decision(self) -> dict:
+        data = {"server": self.uint(), "k": self.uint(), "applied": self.uint()}
+        data["decided"] = self.ids()
+        return data
+
+
+def encode(kind: int, data: dict) -> bytes:
+    w = _Writer()
+    w.buf.append(MAGIC)
+    w.buf.append(kind)
+    if kind == REQUEST:
+        w.request(data)
+    elif kind == MESSAGE:
+        w.message(data)
+    elif kind == REQUEST_BATCH:
+        w.uint(len(data["requests"]))
+        for r in data["requests"]:
+            if isinstance(r, bytes):
+                w.frame(REQUEST, r)
+            else:
+                w.request(r)
+    elif kind == MESSAGE_BATCH:
+        w.uint(len(data["messages"]))
+        for msg in data["messages"]:
+            if isinstance(msg, bytes):
+                w.frame(MESSAGE, msg)
+            else:
+                w.message(msg)
+    elif kind == SYNC_RESPONSE:
+        w.uint(len(data["requests"]))
+        for r in data["requests"]:
+            w.request(r)
+        w.uint(len(data["messages"]))
+        for msg in data["messages"]:
+            w.message(msg)
+        w.buf.append(1 if data["more"] else 0)
+        proposals = data.get("proposals", [])
+        w.uint(len(proposals))
+        for p in proposals:
+            w.proposal(p)
+        decisions = data.get("decisions", [])
+        w.uint(len(decisions))
+        for d in decisions:
+            w.decision(d)
+    elif kind == PROPOSAL:
+        w.proposal(data)
+    elif kind == DECISION:
+        w.decision(data)
+    else:
+        raise WireError(f"unknown kind {kind}")
+    return bytes(w.buf)
+
+
+def decode(body: bytes) -> tuple[int, dict]:
+    r = _Reader(body)
+    if r.byte() != MAGIC:
+        raise WireError("not a binary frame")
+    kind = r.byte()
+    if kind == REQUEST:
+        data = r.request()
+    elif kind == MESSAGE:
+        data = r.message()
+    elif kind == REQUEST_BATCH:
+        data = {"requests": [r.request() for _ in range(r.uint())]}
+    elif kind == MESSAGE_BATCH:
+        data = {"messages": [r.message() for _ in range(r.uint())]}
+    elif kind == SYNC_RESPONSE:
+        data = {"requests": [r.request() for _ in range(r.uint())]}
+        data["messages"] = [r.message() for _ in range(r.uint())]
+        data["more"] = r.byte() == 1
+        data["proposals"] = [r.proposal() for _ in range(r.uint())]
+        data["decisions"] = [r.decision() for _ in range(r.uint())]
+    elif kind == PROPOSAL:
+        data = r.proposal()
+    elif kind == DECISION:
+        data = r.decision()
+    else:
+        raise WireError(f"unknown kind {kind}")
+    if r.pos != len(r.data):
+        raise WireError("trailing bytes after frame")
+    return kind, data
+
+
+def is_binary(body: bytes) -> bool:
+    return body[:1] == bytes([MAGIC])
+
+
+def plain(data: dict) -> dict:
+    # data with the frames in its batches decoded, for the JSON form
+    return {
+        field: [decode(x)[1] if isinstance(x, bytes) else x for x in value]
+        if isinstance(value, list)
+        else value
+        for field, value in data.items()
+    }
@@ -0,0 +1,40 @@
+import os
+import sys
+import logging.config
+
+import pytest
+
+# the application modules import each other by their bare names
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "application"))
+
+# read when the modules are first imported; a single node whose senders run
+# in process, so tests need neither Redis nor peers
+os.environ.setdefault("NODE_URLS", "localhost:8001")
+os.environ.setdefault("NODE_ID", "0")
+os.environ.setdefault("IN_PROCESS", "1")
+os.environ.setdefault("QUEUE_BACKEND", "memory")
+os.environ.setdefault("ANTI_ENTROPY_INTERVAL", "0")
+
+
+@pytest.fixture
+def start_node(monkeypatch):
+    # imports a fresh main.py, whose module globals are the node's state, so
+    # that each call is a restart of the node
+    pytest.importorskip("fastapi")
+    import httpx
+
+    def start(**env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        sys.modules.pop("main", None)
+        import main
+
+        main.get_http_client = lambda: httpx.AsyncClient(
+            transport=httpx.MockTransport(
+                lambda request: httpx.Response(200, json={"msg": "ok"})
+            )
+        )
+        return main
+
+    yield start
+    sys.modules.pop("main", None)
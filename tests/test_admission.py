@@ -0,0 +1,62 @@
+from admission import AdmissionController, retry_after_header
+
+WEAK = {"tentative": 100, "gossip_backlog": 0}
+STRONG = {"tentative": 100, "unordered": 10}
+OVERLOAD = {"execution_lag": 1000}
+
+
+def controller():
+    return AdmissionController(WEAK, STRONG, OVERLOAD, retry_after=1.0)
+
+
+def test_admits_under_the_limits():
+    admission = controller()
+    signals = {"tentative": 99, "unordered": 9, "gossip_backlog": 10**6}
+    assert admission.check(False, signals) is None
+    assert admission.check(True, signals) is None
+    assert admission.rejected == {"weak": 0, "strong": 0}
+
+
+def test_classes_have_separate_budgets():
+    admission = controller()
+    signals = {"unordered": 10}
+    assert admission.check(False, signals) is None
+    status, reason, retry = admission.check(True, signals)
+    assert (status, reason, retry) == (429, "unordered 10 over limit 10", 1.0)
+    assert admission.rejected == {"weak": 0, "strong": 1}
+
+
+def test_overload_sheds_everything():
+    admission = controller()
+    for strong_op in (False, True):
+        status, reason, _ = admission.check(strong_op, {"execution_lag": 1000})
+        assert status == 503
+        assert reason.startswith("execution_lag")
+    assert admission.rejected == {"weak": 1, "strong": 1}
+
+
+def test_retry_after_grows_with_the_excess_up_to_a_cap():
+    admission = controller()
+    assert admission.check(False, {"tentative": 250})[2] == 2.5
+    assert admission.check(False, {"tentative": 10**6})[2] == 30.0
+    assert retry_after_header(0.2) == "1"
+    assert retry_after_header(2.5) == "3"
+
+
+def test_invoke_sheds_weak_writes(start_node):
+    from fastapi.testclient import TestClient
+
+    main = start_node(ADMIT_WEAK_TENTATIVE="1")
+    with TestClient(main.app) as client:
+        put = {"op": ["PUT", "a", 1], "strong_op": False}
+        assert client.post("/invoke", json=put).status_code == 200
+        resp = client.post("/invoke", json=put)
+        assert resp.status_code == 429
+        assert resp.headers["retry-after"] == "1"
+        assert resp.json()["detail"] == "tentative 1 over limit 1"
+        # weak reads queue nothing and strong ops have their own budget
+        get = {"op": ["GET", "a"], "strong_op": False}
+        assert client.post("/invoke", json=get).status_code == 200
+        strong = {"op": ["PUT", "b", 1], "strong_op": True}
+        assert client.post("/invoke", json=strong).status_code == 200
+        assert client.get("/metrics").json()["rejected_weak"] == 1
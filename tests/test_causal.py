@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+from causal import VersionVector, WaitingOps, WatermarkSet
+
+
+def random_ids(rnd: random.Random, n: int) -> set:
+    # mostly contiguous per node, with holes, like delivered event numbers
+    return {
+        (node, event)
+        for node in range(3)
+        for event in range(1, n + 1)
+        if rnd.random() < 0.8
+    }
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_version_vector_round_trip(seed):
+    rnd = random.Random(seed)
+    ids = random_ids(rnd, 50)
+    vv = VersionVector(ids)
+    assert set(vv) == ids
+    assert len(vv) == len(ids)
+    restored = VersionVector.from_json(vv.to_json())
+    assert restored == vv
+    assert set(restored) == ids
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_version_vector_matches_set(seed):
+    rnd = random.Random(seed)
+    ids = random_ids(rnd, 30)
+    other_ids = random_ids(rnd, 30)
+    vv, other = VersionVector(ids), VersionVector(other_ids)
+    removed = set(rnd.sample(sorted(ids), min(5, len(ids))))
+    assert set(vv - removed) == ids - removed
+    assert set(vv.difference(other)) == ids - other_ids
+    assert vv.issubset(other) == ids.issubset(other_ids)
+    assert VersionVector(ids & other_ids).issubset(other)
+    for node in range(3):
+        for event in range(0, 32):
+            assert ((node, event) in vv) == ((node, event) in ids)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_watermark_set_round_trip(seed):
+    rnd = random.Random(seed)
+    ids = random_ids(rnd, 50)
+    order = sorted(ids)
+    rnd.shuffle(order)
+    seen = WatermarkSet()
+    for req_id in order:
+        seen.add(req_id)
+    seen.add(order[0])
+    assert len(seen) == len(ids)
+    restored = WatermarkSet.from_json(seen.to_json())
+    assert restored.watermark == seen.watermark
+    assert restored.above == seen.above
+    for node in range(3):
+        for event in range(1, 52):
+            assert ((node, event) in restored) == ((node, event) in ids)
+    other_ids = random_ids(rnd, 50)
+    other = WatermarkSet()
+    for req_id in other_ids:
+        other.add(req_id)
+    assert set(seen.difference(other)) == ids - other_ids
+
+
+def test_waiting_ops_wake_on_last_dependency():
+    waiting = WaitingOps()
+
+    class Op:
+        def __init__(self, id):
+            self.id = id
+
+    a, b = Op((1, 1)), Op((1, 2))
+    waiting.park(a, [(0, 1), (0, 2)])
+    waiting.park(b, [(0, 2)])
+    assert waiting.wake((0, 1)) == []
+    assert waiting.get((1, 1)) is a
+    assert waiting.wake((0, 2)) == [a, b]
+    assert len(waiting) == 0
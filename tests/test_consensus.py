@@ -0,0 +1,59 @@
+import asyncio
+
+import consensus
+
+
+def proposal(k, unordered, **fields):
+    return {"server": 1, "k": k, "applied": 0, "unordered": unordered, **fields}
+
+
+def test_delta_proposals_against_the_base(start_node):
+    from fastapi.testclient import TestClient
+
+    main = start_node()
+    with TestClient(main.app) as client:
+
+        def propose(data):
+            return client.post("/propose-cab", json=data).json()["msg"]
+
+        assert propose(proposal(1, [[1, 1], [1, 2]])) == "Received"
+        delta = proposal(2, [[1, 3]], removed=[[1, 1]], base=1)
+        assert propose(delta) == "Received"
+        assert main.proposal_of(1, 2) == {(1, 2), (1, 3)}
+        # a delta against a proposal this node never got is not delivered
+        assert propose(proposal(3, [[1, 4]], base=7)) == "Missing base"
+        assert 1 not in main.DELIVERED_CONSENSUS_PROPOSALS.get(3, {})
+        assert propose(proposal(3, [[1, 4]])) == "Received"
+
+
+def test_propose_sends_deltas_and_falls_back_to_the_full_set(monkeypatch):
+    sent = []
+    # the peer lost the proposals it acknowledged, e.g. after a restart
+    missing = {3}
+
+    async def send_proposal(client, node_index, data, path):
+        sent.append(data)
+        if data.get("base") is not None and data["k"] in missing:
+            return {"msg": "Missing base"}
+        return {"msg": "Received"}
+
+    monkeypatch.setattr(consensus, "send_proposal", send_proposal)
+    monkeypatch.setattr(consensus, "ACKED_PROPOSALS", {})
+
+    def propose(k, unordered):
+        sent.clear()
+        item = proposal(k, unordered)
+        asyncio.run(consensus.propose(None, 1, item))
+        return sent
+
+    assert propose(1, [[0, 1], [0, 2]]) == [proposal(1, [[0, 1], [0, 2]])]
+    (delta,) = propose(2, [[0, 2], [0, 3]])
+    assert delta["base"] == 1
+    assert (delta["unordered"], delta["removed"]) == ([[0, 3]], [[0, 1]])
+    delta, full = propose(3, [[0, 4]])
+    assert delta["base"] == 2
+    assert full == proposal(3, [[0, 4]])
+    # the full set was acknowledged, so the next delta is against it
+    (delta,) = propose(4, [[0, 4], [0, 5]])
+    assert delta["base"] == 3
+    assert (delta["unordered"], delta["removed"]) == ([[0, 5]], [])
@@ -0,0 +1,53 @@
+import random
+
+from dissemination import Dissemination
+
+
+def test_initial_fanout_is_about_log2_n():
+    assert Dissemination(16).fanout == 4
+    assert Dissemination(16).max_fanout == 5
+    assert Dissemination(2).fanout == 1
+    assert Dissemination(16, min_fanout=6).fanout == 6
+
+
+def test_fanout_follows_duplicates():
+    d = Dissemination(16, window=10, duplicate_target=0.5)
+    # a saturated cluster: most pushed items were already known
+    for _ in range(10):
+        d.record_response(10, 9)
+    assert d.fanout == d.min_fanout == 1
+    # a cluster where pushes bring news
+    for _ in range(10):
+        d.record_response(10, 0)
+    assert d.fanout == d.max_fanout == 5
+
+
+def test_fanout_changes_once_per_window():
+    d = Dissemination(16, window=100)
+    d.record_response(60, 60)
+    assert d.fanout == 4
+    d.record_response(40, 40)
+    assert d.fanout == 3
+    # inside the target band nothing changes
+    d.record_response(100, 40)
+    assert d.fanout == 3
+
+
+def test_choose_prefers_fast_peers(monkeypatch):
+    d = Dissemination(5, min_fanout=1, max_fanout=1)
+    monkeypatch.setattr(random, "random", random.Random(0).random)
+    for peer in range(1, 5):
+        d.record_send(peer, 0.001 if peer == 1 else 0.1, True)
+    picks = [d.choose(0) for _ in range(1000)]
+    assert all(len(p) == 1 and p[0] != 0 for p in picks)
+    fast = sum(p == [1] for p in picks)
+    assert fast > 700
+    # slow peers are still picked now and then
+    assert fast < 1000
+
+
+def test_failed_sends_count_as_slow():
+    d = Dissemination(3)
+    d.record_send(1, 0.01, True)
+    d.record_send(1, 0.0, False)
+    assert d.latency[1] > 0.01
@@ -0,0 +1,45 @@
+from hlc import LOGICAL_BITS, HybridLogicalClock
+
+
+class FakeClock:
+    def __init__(self, us: int):
+        self.us = us
+
+    def __call__(self) -> int:
+        return self.us
+
+
+def test_timestamps_increase_while_the_clock_stands_still():
+    clock = HybridLogicalClock(FakeClock(1000))
+    stamps = [clock.now() for _ in range(5)]
+    assert stamps == sorted(set(stamps))
+    assert stamps[0] == 1000 << LOGICAL_BITS
+
+
+def test_timestamps_follow_physical_time_and_never_go_back():
+    physical = FakeClock(1000)
+    clock = HybridLogicalClock(physical)
+    first = clock.now()
+    physical.us = 2000
+    assert clock.now() == 2000 << LOGICAL_BITS
+    physical.us = 500
+    assert clock.now() > 2000 << LOGICAL_BITS > first
+
+
+def test_update_orders_later_ops_after_peer_timestamps():
+    clock = HybridLogicalClock(FakeClock(1000))
+    peer = (1500 << LOGICAL_BITS) + 7
+    assert clock.update(peer) == peer
+    assert clock.now() == peer + 1
+    # an older peer timestamp does not move the clock back
+    assert clock.update(10) == peer + 1
+
+
+def test_update_clamps_timestamps_beyond_the_drift():
+    physical = FakeClock(1_000_000)
+    clock = HybridLogicalClock(physical, max_drift_ms=10)
+    limit = (1_000_000 + 10_000) << LOGICAL_BITS
+    assert clock.update(limit) == limit
+    assert clock.update(1 << 62) == limit
+    physical.us = 2_000_000
+    assert clock.now() == 2_000_000 << LOGICAL_BITS
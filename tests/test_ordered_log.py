@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from ordered_log import OrderedLog, order_key
+from req import Request
+
+
+def request(node, event_no, ts):
+    return Request((node, event_no), ["PUT", "k", event_no], False, [], ts=ts)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_a_rebuilt_list(seed):
+    rnd = random.Random(seed)
+    log = OrderedLog()
+    committed, tentative = [], []
+    for event_no in range(1, 300):
+        if rnd.random() < 0.7 or not tentative:
+            r = request(rnd.randint(0, 2), event_no, rnd.randint(0, 50))
+            pos = log.insert(r)
+            tentative.append(r)
+            tentative.sort(key=order_key)
+            assert pos == len(committed) + tentative.index(r)
+            # inserting again changes nothing
+            assert log.insert(r) == pos
+        else:
+            reqs = rnd.sample(tentative, rnd.randint(1, min(3, len(tentative))))
+            before = committed + tentative
+            changed = log.commit(reqs)
+            for r in reqs:
+                tentative.remove(r)
+            committed.extend(reqs)
+            after = committed + tentative
+            # the first position whose entry changed, len(after) if none did
+            expected = next(
+                (i for i, (x, y) in enumerate(zip(before, after)) if x is not y),
+                len(after),
+            )
+            assert changed == expected
+        full = committed + tentative
+        assert list(log) == full
+        assert len(log) == len(full)
+        pos = rnd.randrange(len(full))
+        assert log.at(pos) is full[pos]
+        assert log.position(full[pos]) == pos
+        assert list(log.iter_from(pos)) == full[pos:]
+        assert sorted(full, key=log.sort_key) == full
+
+
+def test_tentative_queries():
+    log = OrderedLog()
+    a, b, c = request(0, 1, 5), request(1, 1, 3), request(2, 1, 9)
+    for r in (a, b, c):
+        log.insert(r)
+    log.commit([a])
+    assert log.is_committed(a.id) and not log.is_committed(b.id)
+    assert log.tentative_in({a.id, c.id, b.id}) == [b, c]
+    assert log.tentative_in({c.id, (5, 5)}) == [c]
+    assert list(log.tentative_after(b)) == [c]
@@ -0,0 +1,157 @@
+import random
+
+import pytest
+
+from ordered_log import OrderedLog
+from planner import ConflictAwarePlanner, ExecutionPlanner
+from req import Request
+from state import State
+from storage import MemoryStorage, SqliteStorage
+
+KEYS = ["a", "b", "c", "d", "e", "f"]
+PLANNERS = ["full", "conflict_aware"]
+
+
+# One replica's log, planner and state, driven the way main.py drives them
+# but with every step chosen by the test.
+class Replica:
+    def __init__(self, planner, storage):
+        self.log = OrderedLog()
+        self.state = State(storage)
+        if planner == "conflict_aware":
+            self.planner = ConflictAwarePlanner(self.log, self.state)
+        else:
+            self.planner = ExecutionPlanner(self.log)
+        # the result of the latest execution of each op
+        self.results = {}
+
+    def insert(self, r: Request):
+        self.planner.insert(r)
+        self.planner.plan()
+
+    def commit(self, reqs: list[Request]):
+        self.planner.commit(reqs)
+        self.planner.plan()
+        for x in reqs:
+            if self.planner.is_executed(x):
+                self.state.commit(x)
+
+    def step(self) -> bool:
+        r = self.planner.next_rollback()
+        if r is not None:
+            self.state.rollback(r)
+            return True
+        r = self.planner.next_execution()
+        if r is None:
+            return False
+        self.results[r.id] = self.state.execute(r)
+        self.planner.mark_executed(r)
+        if self.log.is_committed(r.id):
+            self.state.commit(r)
+        return True
+
+    def checkpoint(self):
+        storage = self.state.storage
+        if storage.snapshot() is None:
+            storage.persist(0)
+            storage.finish_checkpoint()
+
+
+def random_op(rnd: random.Random, event_no: int) -> list:
+    x = rnd.random()
+    if x < 0.4:
+        return ["PUT", rnd.choice(KEYS), event_no]
+    if x < 0.6:
+        return ["MPUT", [[k, event_no] for k in rnd.sample(KEYS, 2)]]
+    if x < 0.8:
+        return ["GET", rnd.choice(KEYS)]
+    return ["MGET", rnd.sample(KEYS, 3)]
+
+
+def sequential(reqs) -> tuple[State, dict]:
+    # the reference: every op executed once, in order, with no rollbacks
+    state = State()
+    results = {r.id: state.execute(r) for r in reqs}
+    return state, results
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "sqlite":
+        # a tiny cache so that most reads go to the file
+        storage = SqliteStorage(str(tmp_path / "state.sqlite"), cache_size=2)
+        yield storage
+        storage.close()
+    else:
+        yield MemoryStorage()
+
+
+def run(planner, seed, storage) -> Replica:
+    rnd = random.Random(seed)
+    replica = Replica(planner, storage)
+    for event_no in range(1, 500):
+        x = rnd.random()
+        if x < 0.5:
+            # ops arrive out of timestamp order from three nodes
+            r = Request(
+                (rnd.randint(0, 2), event_no),
+                random_op(rnd, event_no),
+                False,
+                [],
+                ts=rnd.randint(0, 100),
+            )
+            replica.insert(r)
+        elif x < 0.6 and replica.log.tentative:
+            replica.commit([rnd.choice(list(replica.log.tentative))])
+        elif x < 0.65:
+            replica.checkpoint()
+        else:
+            for _ in range(rnd.randint(0, 5)):
+                replica.step()
+    while replica.step():
+        pass
+    return replica
+
+
+@pytest.mark.parametrize("planner", PLANNERS)
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_sequential_execution(planner, seed, storage):
+    replica = run(planner, seed, storage)
+    log = list(replica.log)
+    assert all(replica.planner.is_executed(r) for r in log)
+    reference, results = sequential(log)
+    for key in KEYS:
+        assert replica.state.read(key) == reference.read(key)
+    assert replica.results == results
+
+
+@pytest.mark.parametrize("planner", PLANNERS)
+@pytest.mark.parametrize("seed", range(5))
+def test_committed_values_match_the_committed_log(planner, seed, storage):
+    replica = run(planner, seed, storage)
+    committed, _ = sequential(replica.log.committed)
+    for key in KEYS:
+        assert replica.state.read_committed(key) == committed.read(key)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_conflict_aware_rolls_back_less(seed):
+    # on a wide key space most ops commute with a late insert
+    rnd = random.Random(seed)
+    reqs = [
+        Request((1, i), ["PUT", f"k{rnd.randint(0, 999)}", i], False, [], ts=i)
+        for i in range(1, 300)
+    ]
+    counts = {}
+    for planner in ("full", "conflict_aware"):
+        replica = Replica(planner, MemoryStorage())
+        for r in reqs:
+            replica.insert(r)
+            while replica.step():
+                pass
+        late = Request((2, 1), ["PUT", "k0", 0], False, [], ts=1)
+        replica.insert(late)
+        while replica.step():
+            pass
+        counts[planner] = replica.planner.rolledback_count
+    assert counts["conflict_aware"] < counts["full"]
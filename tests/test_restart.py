@@ -0,0 +1,56 @@
+from fastapi.testclient import TestClient
+
+
+def put(client, key, value):
+    body = {"op": ["PUT", key, value], "strong_op": False, "wait": True}
+    return client.post("/invoke", json=body)
+
+
+def get(client, key):
+    return client.post("/invoke", json={"op": ["GET", key], "strong_op": False})
+
+
+def test_restart_from_snapshot_and_wal(start_node, tmp_path):
+    main = start_node(WAL_DIR=str(tmp_path))
+    with TestClient(main.app) as client:
+        assert put(client, "a", 1).json()["event_no"] == 1
+        assert put(client, "b", 2).status_code == 200
+        assert client.portal.call(
+            main.WAL.checkpoint, main.snapshot_state, main.STATE.storage.persist
+        )
+        assert put(client, "a", 3).status_code == 200
+
+    main = start_node(WAL_DIR=str(tmp_path))
+    with TestClient(main.app) as client:
+        assert len(main.LOG) == 3
+        assert get(client, "a").json()["result"] == 3
+        assert get(client, "b").json()["result"] == 2
+        # event numbers continue where the log left off
+        assert put(client, "c", 4).json()["event_no"] == 4
+
+
+def test_failed_wal_changes_and_sends_nothing(start_node, tmp_path):
+    main = start_node(WAL_DIR=str(tmp_path))
+    with TestClient(main.app) as client:
+        assert put(client, "a", 1).status_code == 200
+        queued = []
+        main.r.lpush = lambda queue, msg: queued.append(msg)
+
+        def fail(lines):
+            raise OSError(5, "EIO")
+
+        main.WAL._write = fail
+        resp = put(client, "b", 2)
+        assert resp.status_code == 503
+        assert main.REQUEST_AWAITING_RESP == {}
+        assert queued == []
+        # the op whose sync failed is neither served nor synced to peers
+        assert get(client, "b").status_code == 503
+        assert put(client, "c", 3).status_code == 503
+        sync = {"delivered": {}, "delivered_cab": {}}
+        assert client.post("/sync", json=sync).status_code == 503
+
+    main = start_node(WAL_DIR=str(tmp_path))
+    with TestClient(main.app) as client:
+        assert [x.id for x in main.LOG] == [(0, 1)]
+        assert get(client, "a").json()["result"] == 1
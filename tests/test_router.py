@@ -0,0 +1,107 @@
+import sys
+import json
+
+import pytest
+
+from sharding import shard_for_key, split_op
+
+KEYS = "abcdefgh"
+A = next(k for k in KEYS if shard_for_key(k, 2) == 0)
+B = next(k for k in KEYS if shard_for_key(k, 2) == 1)
+
+
+def test_split_op_groups_keys_by_shard():
+    assert split_op(["MGET", [B, A, B]], 2) == {1: ["MGET", [B, B]], 0: ["MGET", [A]]}
+    assert split_op(["MPUT", [[A, 1], [B, 2]]], 2) == {
+        0: ["MPUT", [[A, 1]]],
+        1: ["MPUT", [[B, 2]]],
+    }
+    assert split_op(["PUT", B, 1], 2) == {1: ["PUT", B, 1]}
+
+
+@pytest.fixture
+def router_client(monkeypatch):
+    # two shards answered by a handler; shards in shed answer 429
+    pytest.importorskip("fastapi")
+    import httpx
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setenv("SHARD_URLS", "s0,s1")
+    sys.modules.pop("router", None)
+    import router
+
+    shed = set()
+
+    def handler(request):
+        body = json.loads(request.content)
+        if int(request.url.host[1]) in shed:
+            return httpx.Response(
+                429,
+                json={"detail": "overloaded", "retry_after_ms": 2000},
+                headers={"retry-after": "2"},
+            )
+        if request.url.path == "/invoke-batch":
+            responses = [{"result": "OK"} for _ in body["requests"]]
+            return httpx.Response(200, json={"responses": responses})
+        op = body["op"]
+        # an MGET returns each key as its value
+        return httpx.Response(200, json={"result": op[1] if op[0] == "MGET" else "OK"})
+
+    router.get_http_client = lambda: httpx.AsyncClient(
+        transport=httpx.MockTransport(handler)
+    )
+    with TestClient(router.app) as client:
+        yield client, shed
+    sys.modules.pop("router", None)
+
+
+def test_split_mget_keeps_the_key_order(router_client):
+    client, _ = router_client
+    resp = client.post("/invoke", json={"op": ["MGET", [B, A]], "strong_op": False})
+    assert resp.status_code == 200
+    assert resp.json()["result"] == [B, A]
+    assert [p["shard"] for p in resp.json()["parts"]] == [1, 0]
+
+
+def test_strong_ops_are_not_split(router_client):
+    client, _ = router_client
+    op = {"op": ["MPUT", [[A, 1], [B, 2]]], "strong_op": True}
+    assert client.post("/invoke", json=op).status_code == 400
+
+
+def test_partly_shed_split_op_is_207(router_client):
+    client, shed = router_client
+    shed.add(1)
+    op = {"op": ["MPUT", [[A, 1], [B, 2]]], "strong_op": False}
+    resp = client.post("/invoke", json=op)
+    assert resp.status_code == 207
+    assert resp.headers["retry-after"] == "2"
+    assert [(p["shard"], p["status"]) for p in resp.json()["parts"]] == [
+        (0, 200),
+        (1, 429),
+    ]
+    # when no part goes through, the shard's answer is passed on
+    shed.add(0)
+    resp = client.post("/invoke", json=op)
+    assert resp.status_code == 429
+    assert resp.headers["retry-after"] == "2"
+
+
+def test_batch_reports_each_request(router_client):
+    client, shed = router_client
+    requests = [
+        {"op": ["PUT", A, 1], "strong_op": False},
+        {"op": ["PUT", B, 1], "strong_op": False},
+        {"op": ["MPUT", [[A, 1], [B, 2]]], "strong_op": True},
+    ]
+    shed.add(1)
+    resp = client.post("/invoke-batch", json={"requests": requests})
+    assert resp.status_code == 207
+    assert [r["status"] for r in resp.json()["responses"]] == [200, 429, 400]
+    shed.add(0)
+    resp = client.post("/invoke-batch", json={"requests": requests[:2]})
+    assert resp.status_code == 429
+    shed.clear()
+    resp = client.post("/invoke-batch", json={"requests": requests[:2]})
+    assert resp.status_code == 200
+    assert [r["shard"] for r in resp.json()["responses"]] == [0, 1]
@@ -0,0 +1,77 @@
+import asyncio
+
+import httpx
+from fastapi.testclient import TestClient
+
+import wire
+
+
+def sync_body(**fields):
+    return {"delivered": {}, "delivered_cab": {}, **fields}
+
+
+def test_sync_returns_open_consensus_instances(start_node):
+    main = start_node()
+    with TestClient(main.app) as client:
+        main.deliver_proposal(1, 1, {(1, 1)})
+        main.deliver_proposal(1, 2, {(1, 2)})
+        main.DELIVERED_CONSENSUS_DECISIONS[1] = {1: {(1, 1)}}
+        data = client.post("/sync", json=sync_body(applied_k=1)).json()
+        assert data["proposals"] == [{"server": 1, "k": 2, "unordered": [[1, 2]]}]
+        assert data["decisions"] == []
+        resp = client.post(
+            "/sync", json=sync_body(), headers={"accept": wire.CONTENT_TYPE}
+        )
+        _, data = wire.decode(resp.content)
+        assert [(p["server"], p["k"]) for p in data["proposals"]] == [(1, 1), (1, 2)]
+        assert data["decisions"][0]["decided"] == [[1, 1]]
+
+
+def test_synced_consensus_messages_are_delivered_once(start_node):
+    main = start_node()
+    data = {
+        "requests": [],
+        "messages": [],
+        "more": False,
+        "proposals": [
+            {"server": 1, "k": 1, "unordered": [[1, 1]]},
+            # only this node makes its own proposals
+            {"server": 0, "k": 1, "unordered": [[9, 9]]},
+        ],
+        "decisions": [{"server": 1, "k": 1, "decided": [[1, 1]]}],
+    }
+    assert main.apply_sync(data) == 2
+    assert main.DELIVERED_CONSENSUS_PROPOSALS[1] == {1: {(1, 1)}}
+    assert main.DELIVERED_CONSENSUS_DECISIONS[1] == {1: {(1, 1)}}
+    assert main.apply_sync(data) == 0
+
+
+def test_anti_entropy_survives_bad_responses(start_node, monkeypatch):
+    main = start_node()
+    monkeypatch.setattr(main, "get_node_ids_excluding", lambda node: [1])
+    monkeypatch.setattr(main, "get_node_address", lambda node: "http://peer")
+    bodies = [
+        # invalid UTF-8 in a string, a truncated frame, a missing field
+        bytes([wire.MAGIC, wire.SYNC_RESPONSE, 1]) + b"\x00\x00\x00\x00\x0a\x02\x01\xff",
+        bytes([wire.MAGIC, wire.SYNC_RESPONSE, 1]),
+        b'{"requests": [], "messages": []}',
+    ]
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) <= len(bodies):
+            body = bodies[len(calls) - 1]
+            content_type = wire.CONTENT_TYPE if wire.is_binary(body) else "application/json"
+            return httpx.Response(200, content=body, headers={"content-type": content_type})
+        return httpx.Response(200, json={"requests": [], "messages": [], "more": False})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            task = asyncio.create_task(main.anti_entropy(client))
+            while len(calls) <= len(bodies) and not task.done():
+                await asyncio.sleep(0.01)
+            assert not task.done()
+            task.cancel()
+
+    asyncio.run(run())
@@ -0,0 +1,109 @@
+import asyncio
+import os
+
+import pytest
+
+import wal
+from wal import WALError, WriteAheadLog
+
+
+def reopen(directory, persisted_segment=None):
+    log = WriteAheadLog(str(directory))
+    snapshot, records = log.load(persisted_segment)
+    return log, snapshot, records
+
+
+def append(log, *records):
+    async def run():
+        for record in records:
+            log.append(record)
+        await log.sync()
+
+    asyncio.run(run())
+
+
+def checkpoint(log, snapshot, persist=None):
+    return asyncio.run(log.checkpoint(lambda: dict(snapshot), persist))
+
+
+@pytest.mark.parametrize("torn", ['{"i":2', '{"i":2}'])
+def test_torn_tail_is_cut_before_appending(tmp_path, torn):
+    log, _, _ = reopen(tmp_path)
+    append(log, {"i": 1})
+    log.close()
+    # a crash in the middle of the next write; even a complete record
+    # without its newline was not acknowledged
+    with open(tmp_path / "wal-0.log", "a") as f:
+        f.write(torn)
+
+    log, snapshot, records = reopen(tmp_path)
+    assert snapshot is None
+    assert records == [{"i": 1}]
+    append(log, {"i": 3})
+    log.close()
+
+    _, _, records = reopen(tmp_path)
+    assert records == [{"i": 1}, {"i": 3}]
+
+
+def test_checkpoint_replays_only_the_new_segment(tmp_path):
+    log, _, _ = reopen(tmp_path)
+    append(log, {"i": 1}, {"i": 2})
+    assert checkpoint(log, {"n": 2})
+    append(log, {"i": 3})
+    log.close()
+
+    log, snapshot, records = reopen(tmp_path)
+    assert snapshot == {"n": 2, "segment": 1}
+    assert records == [{"i": 3}]
+    assert sorted(os.listdir(tmp_path)) == ["snapshot.json", "wal-1.log"]
+    append(log, {"i": 4})
+    assert checkpoint(log, {"n": 4})
+    log.close()
+
+    _, snapshot, records = reopen(tmp_path)
+    assert snapshot == {"n": 4, "segment": 2}
+    assert records == []
+
+
+def test_persisted_checkpoint_without_renamed_snapshot(tmp_path, monkeypatch):
+    log, _, _ = reopen(tmp_path)
+    append(log, {"i": 1})
+    persisted = []
+
+    def crash(src, dst):
+        raise OSError("crash before the rename")
+
+    # the store commits the checkpoint, then the process dies
+    monkeypatch.setattr(wal.os, "replace", crash)
+    assert not checkpoint(log, {"n": 1}, persisted.append)
+    monkeypatch.undo()
+    log.close()
+    assert persisted == [1]
+
+    # without the store's segment the old snapshot and segment still apply
+    _, snapshot, records = reopen(tmp_path)
+    assert snapshot is None
+    assert records == [{"i": 1}]
+    _, snapshot, records = reopen(tmp_path, persisted_segment=1)
+    assert snapshot == {"n": 1, "segment": 1}
+    assert records == []
+
+
+def test_failed_write_stops_the_log(tmp_path, monkeypatch):
+    log, _, _ = reopen(tmp_path)
+    append(log, {"i": 1})
+
+    def fail(lines):
+        raise OSError("EIO")
+
+    monkeypatch.setattr(log, "_write", fail)
+    with pytest.raises(WALError):
+        append(log, {"i": 2})
+    with pytest.raises(WALError):
+        append(log, {"i": 3})
+    assert log.failed is not None
+    log.close()
+
+    _, _, records = reopen(tmp_path)
+    assert records == [{"i": 1}]
@@ -0,0 +1,104 @@
+import pytest
+
+import wire
+from causal import VersionVector
+from req import Request
+
+REQUEST = Request(
+    (1, 300),
+    ["MPUT", [["k", -1.5], [7, {"nested": [None, True, False, "x" * 200]}]]],
+    True,
+    VersionVector([(0, 1), (0, 3), (2, 128)]),
+    ts=1 << 60,
+).to_json()
+MESSAGE = {"m": [2, 70000], "q": "check_dep"}
+PROPOSAL = {
+    "server": 2,
+    "k": 12,
+    "applied": 10,
+    "base": 0,
+    "unordered": [[0, 1], [1, 2]],
+    "removed": [[2, 3]],
+}
+DECISION = {"server": 1, "k": 12, "applied": 11, "decided": [[0, 1]]}
+
+FRAMES = [
+    (wire.REQUEST, REQUEST),
+    (wire.MESSAGE, MESSAGE),
+    (wire.REQUEST_BATCH, {"requests": [REQUEST, REQUEST]}),
+    (wire.MESSAGE_BATCH, {"messages": [MESSAGE]}),
+    (wire.PROPOSAL, PROPOSAL),
+    (wire.DECISION, DECISION),
+    (
+        wire.SYNC_RESPONSE,
+        {
+            "requests": [REQUEST],
+            "messages": [MESSAGE],
+            "more": True,
+            "proposals": [PROPOSAL],
+            "decisions": [DECISION],
+        },
+    ),
+]
+
+
+@pytest.mark.parametrize("kind, data", FRAMES)
+def test_round_trip(kind, data):
+    frame = wire.encode(kind, data)
+    assert wire.is_binary(frame)
+    assert wire.decode(frame) == (kind, data)
+
+
+def test_request_round_trip():
+    decoded = Request.from_json(wire.decode(wire.encode(wire.REQUEST, REQUEST))[1])
+    assert decoded.to_json() == REQUEST
+
+
+def test_proposal_without_base():
+    data = {"server": 0, "k": 1, "unordered": [], "applied": 0}
+    _, decoded = wire.decode(wire.encode(wire.PROPOSAL, data))
+    assert decoded["base"] is None
+    assert decoded["removed"] == []
+
+
+def test_batch_splices_frames():
+    frames = [wire.encode(wire.REQUEST, REQUEST), REQUEST]
+    batch = wire.encode(wire.REQUEST_BATCH, {"requests": frames})
+    assert batch == wire.encode(wire.REQUEST_BATCH, {"requests": [REQUEST, REQUEST]})
+    assert wire.plain({"requests": frames}) == {"requests": [REQUEST, REQUEST]}
+    with pytest.raises(wire.WireError):
+        wire.encode(wire.REQUEST_BATCH, {"requests": [wire.encode(wire.MESSAGE, MESSAGE)]})
+
+
+@pytest.mark.parametrize("kind, data", FRAMES)
+def test_truncated_frames_are_rejected(kind, data):
+    frame = wire.encode(kind, data)
+    for end in range(len(frame)):
+        with pytest.raises(wire.WireError):
+            wire.decode(frame[:end])
+    with pytest.raises(wire.WireError):
+        wire.decode(frame + b"\x00")
+
+
+def invalid_utf8_frame():
+    frame = wire.encode(wire.REQUEST, REQUEST)
+    assert frame.count(b"x" * 200) == 1
+    return frame.replace(b"x" * 200, b"\xff" * 200)
+
+
+def test_invalid_utf8_is_rejected():
+    with pytest.raises(wire.WireError):
+        wire.decode(invalid_utf8_frame())
+
+
+def test_peer_endpoint_rejects_invalid_utf8(start_node):
+    from fastapi.testclient import TestClient
+
+    main = start_node()
+    with TestClient(main.app) as client:
+        resp = client.post(
+            "/gossip",
+            content=invalid_utf8_frame(),
+            headers={"content-type": wire.CONTENT_TYPE},
+        )
+    assert resp.status_code == 422